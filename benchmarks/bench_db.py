@@ -0,0 +1,77 @@
+"""
+入库写入速度测试：不同批次大小下的 rows/sec
+
+用法: python benchmarks/bench_db.py [--rows 20000] [--sizes 50,500,5000] [--sqlite bench.db]
+会向 config.DB_CONFIG 指向的数据库写入测试数据 (FileHash 以 bench 开头)，结束后自动删除；
+指定 --sqlite 时改为写入本地 SQLite 文件，不需要 MySQL 服务
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DB_CONFIG
+from utils.database import get_connection, bulk_save_to_db, _delete_photos
+
+
+def fake_records(n):
+    records = []
+    for i in range(n):
+        records.append({
+            'filename': f"DJI_{i:06d}.JPG", 'FolderName': "bench", 'FullPath': f"/bench/DJI_{i:06d}.JPG",
+            'FileSize': 20 * 1024 ** 2, 'FileType': '.jpg',
+            'FileHash': "bench" + uuid.uuid4().hex[:27], 'capture_time': datetime.now(),
+            'DroneModel': "M30T", 'GpsLatitude': 30.0 + i * 1e-5, 'GpsLongitude': 120.0 + i * 1e-5,
+            'AbsoluteAltitude': 100.0, 'RtkFlag': 50, 'mark_note': None,
+        })
+    return records
+
+
+def cleanup():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM drone_photos WHERE FileHash LIKE 'bench%'")
+    # 经 _delete_photos 删除，各汇总表同步扣减
+    _delete_photos(cursor, [row[0] for row in cursor.fetchall()])
+    conn.commit()
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--sizes", default="50,500,5000")
+    ap.add_argument("--sqlite", default=None, help="改用该 SQLite 文件作为存储后端")
+    args = ap.parse_args()
+
+    if args.sqlite:
+        DB_CONFIG['backend'] = 'sqlite'
+        DB_CONFIG['sqlite_path'] = args.sqlite
+
+    try:
+        for size in [int(x) for x in args.sizes.split(',')]:
+            records = fake_records(args.rows)
+            start = time.perf_counter()
+            reports = bulk_save_to_db(records, batch_size=size, raise_on_error=True)
+            elapsed = time.perf_counter() - start
+
+            # 同一批数据再写一遍，全部应被唯一键跳过
+            start = time.perf_counter()
+            dup_reports = bulk_save_to_db(records, batch_size=size, raise_on_error=True)
+            dup_elapsed = time.perf_counter() - start
+
+            inserted = sum(r['inserted'] for r in reports)
+            skipped = sum(r['skipped'] for r in dup_reports)
+            print(f"batch={size:5d} | 新增 {inserted:6d} 行 {args.rows / elapsed:9.0f} rows/s | "
+                  f"重复写入跳过 {skipped:6d} 行 {args.rows / dup_elapsed:9.0f} rows/s")
+            cleanup()
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+入库吞吐对比：完整 MD5 (full) vs 分级快速指纹 (tiered)
+
+用法: python benchmarks/bench_hash.py <视频目录> [--exts .mp4,.mov]
+注意：第二次读取同一文件可能命中系统缓存，NAS 上测试前建议先清缓存或交换两种模式的顺序
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ingest import scan_files
+from utils.parser import parse_dji_metadata
+from utils.common import format_size
+
+
+def run(files, hash_mode):
+    bytes_read = file_bytes = 0
+    start = time.perf_counter()
+    for full_path, _, _ in files:
+        with open(full_path, 'rb') as f:
+            meta = parse_dji_metadata(f, os.path.basename(full_path), full_path=full_path, hash_mode=hash_mode)
+        if meta:
+            bytes_read += meta['BytesRead']
+            file_bytes += meta['FileSize']
+    elapsed = time.perf_counter() - start
+    return elapsed, {'bytes_read': bytes_read, 'ratio': bytes_read / file_bytes if file_bytes else 0.0}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("folder")
+    ap.add_argument("--exts", default=".mp4,.mov")
+    ap.add_argument("--modes", default="full,tiered")
+    args = ap.parse_args()
+
+    files = scan_files(args.folder, tuple(args.exts.lower().split(',')))
+    total_bytes = sum(item[1] for item in files)
+    print(f"{len(files)} 个文件，共 {format_size(total_bytes)}")
+
+    for mode in args.modes.split(','):
+        elapsed, stats = run(files, mode)
+        print(f"[{mode:6}] {elapsed:8.2f} s | {len(files) / elapsed:8.1f} 个/秒 | "
+              f"{total_bytes / elapsed / 1024 ** 2:9.1f} MB/s (按文件大小) | "
+              f"实际读取 {format_size(stats['bytes_read'])} ({stats['ratio']:.3f}x)")
+
+
+if __name__ == "__main__":
+    main()
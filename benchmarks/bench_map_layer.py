@@ -0,0 +1,109 @@
+"""
+地图打点图层：逐点 CircleMarker / FastMarkerCluster / 密度网格 / 航线轨迹的生成耗时与页面大小
+
+用法: python benchmarks/bench_map_layer.py [--rows 200000] [--legacy-rows 20000]
+使用随机坐标，不需要数据库；逐点方式很慢，单独用 --legacy-rows 控制点数
+"""
+import argparse
+import os
+import sys
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+from folium.plugins import FastMarkerCluster, MarkerCluster
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui_pages.map import POINT_CALLBACK, _grid_from_points, _density_layer, _flight_tracks, _track_layer
+
+
+def fake_points(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'GpsLatitude': 30 + rng.random(n), 'GpsLongitude': 120 + rng.random(n),
+        'filename': [f"DJI_{i:06d}.JPG" for i in range(n)], 'AbsoluteAltitude': rng.random(n) * 200,
+    })
+
+
+def fake_survey(n, lines=10, strips=40):
+    """
+    模拟测绘航线：每条航线往返扫 strips 个条带，2 秒拍一张，坐标带少量抖动
+    """
+    rng = np.random.default_rng(0)
+    per_line = n // lines
+    t = np.arange(per_line) / per_line * strips
+    strip = np.floor(t)
+    along = np.where(strip % 2 == 0, t - strip, 1 - (t - strip))
+    frames = []
+    for line in range(lines):
+        frames.append(pd.DataFrame({
+            'GpsLatitude': 30 + line * 0.05 + strip / strips * 0.04 + rng.normal(0, 2e-6, per_line),
+            'GpsLongitude': 120 + along * 0.04 + rng.normal(0, 2e-6, per_line),
+            'capture_time': pd.Timestamp('2024-05-01') + pd.to_timedelta(line * 86400 + np.arange(per_line) * 2, 's'),
+            'FlightLineInfo': f"line-{line}", 'DroneSerialNumber': "SN",
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    df['filename'] = [f"DJI_{i:06d}.JPG" for i in range(len(df))]
+    df['AbsoluteAltitude'] = 120.0
+    return df
+
+
+def legacy_layer(df):
+    m = folium.Map(location=[30.5, 120.5])
+    cluster = MarkerCluster(disable_clustering_at_zoom=16).add_to(m)
+    for lat, lon, fname, alt in df[['GpsLatitude', 'GpsLongitude', 'filename', 'AbsoluteAltitude']].values:
+        folium.CircleMarker(location=[lat, lon], radius=5, color='red', fill=True, fill_color='red',
+                            fill_opacity=0.7, tooltip=fname, popup=f"<b>{fname}</b><br>高度: {alt}m").add_to(cluster)
+    return m
+
+
+def fast_layer(df):
+    m = folium.Map(location=[30.5, 120.5], prefer_canvas=True)
+    points = df[['GpsLatitude', 'GpsLongitude']].round(6)
+    points['filename'] = df['filename']
+    points['AbsoluteAltitude'] = df['AbsoluteAltitude'].round(1)
+    FastMarkerCluster(points.values.tolist(), callback=POINT_CALLBACK.replace('__RADIUS__', '5'),
+                      disable_clustering_at_zoom=16, chunked_loading=True).add_to(m)
+    return m
+
+
+def density_layer(df, zoom=11):
+    m = folium.Map(location=[30.5, 120.5], prefer_canvas=True)
+    level, cells = _grid_from_points(df, zoom)
+    _density_layer(cells, level).add_to(m)
+    return m
+
+
+def track_layer(df, zoom=14):
+    m = folium.Map(location=[30.25, 120.02], prefer_canvas=True)
+    _track_layer(_flight_tracks(df, zoom)).add_to(m)
+    return m
+
+
+def measure(name, build, df):
+    start = time.perf_counter()
+    html = build(df).get_root().render()
+    elapsed = time.perf_counter() - start
+    print(f"{name:22s} | {len(df):8d} 点 | {elapsed:8.2f} s | {len(html) / 1024 ** 2:8.1f} MB "
+          f"| {len(html) / len(df):6.0f} 字节/点")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--legacy-rows", type=int, default=20000)
+    args = ap.parse_args()
+
+    if args.legacy_rows > 0:
+        measure("CircleMarker 逐点", legacy_layer, fake_points(args.legacy_rows))
+    measure("FastMarkerCluster", fast_layer, fake_points(args.rows))
+    measure("密度网格 (内存分箱)", density_layer, fake_points(args.rows))
+    survey = fake_survey(args.rows)
+    measure("测绘航线 打点", fast_layer, survey)
+    measure("测绘航线 轨迹折线", track_layer, survey)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+地图框选：内存网格索引 (PointIndex) vs 全量布尔筛选的耗时
+
+用法: python benchmarks/bench_point_index.py [--rows 1000000] [--repeat 20]
+使用随机坐标，不需要数据库。最后一组在点密度不变的前提下把总点数放大 100 倍，
+同一个选区的查询耗时应基本不变 (与命中数相关)，全量筛选则随总点数线性增长
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.geo import PointIndex, points_in_polygon, distance_m
+
+RECT = [(119.98, 29.98), (120.02, 29.98), (120.02, 30.02), (119.98, 30.02), (119.98, 29.98)]
+POLYGON = [(119.95, 29.95), (120.05, 29.97), (120.0, 30.05), (119.95, 29.95)]
+CIRCLE = (120.0, 30.0, 2000)
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, len(result)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    lats = rng.normal(30, 0.3, args.rows)
+    lons = rng.normal(120, 0.3, args.rows)
+
+    start = time.perf_counter()
+    index = PointIndex(lats, lons)
+    print(f"建索引 {args.rows} 点: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    cases = [
+        ("矩形", lambda: index.in_ring(RECT),
+         lambda: np.flatnonzero((lats >= 29.98) & (lats <= 30.02) & (lons >= 119.98) & (lons <= 120.02))),
+        ("多边形", lambda: index.in_ring(POLYGON), lambda: np.flatnonzero(points_in_polygon(lons, lats, POLYGON))),
+        ("圆 (2 km)", lambda: index.in_circle(*CIRCLE),
+         lambda: np.flatnonzero(distance_m(CIRCLE[0], CIRCLE[1], lons, lats) <= CIRCLE[2])),
+    ]
+    for name, by_index, by_scan in cases:
+        t_index, n_index = timed(by_index, args.repeat)
+        t_scan, n_scan = timed(by_scan, args.repeat)
+        print(f"{name:8s} | 命中 {n_index:7d} (全量 {n_scan:7d}) | 索引 {t_index:7.2f} ms | 全量筛选 {t_scan:7.2f} ms")
+
+    # 规模扩展：每平方度的点数固定，数据范围随点数扩大，选区和命中数保持不变
+    print("规模扩展 (同一矩形选区):")
+    for rows in (args.rows // 100, args.rows // 10, args.rows):
+        span = np.sqrt(rows / 250000)  # 每平方度约 25 万点
+        lats = 30 + rng.uniform(-span / 2, span / 2, rows)
+        lons = 120 + rng.uniform(-span / 2, span / 2, rows)
+        index = PointIndex(lats, lons)
+        t_index, n_index = timed(lambda: index.in_ring(RECT), args.repeat)
+        t_scan, _ = timed(lambda: np.flatnonzero((lats >= 29.98) & (lats <= 30.02)
+                                                 & (lons >= 119.98) & (lons <= 120.02)), args.repeat)
+        print(f"{rows:9d} 点 | 命中 {n_index:6d} | 索引 {t_index:7.3f} ms | 全量筛选 {t_scan:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+按页面投影读取 vs 读取全部列：耗时与 DataFrame 内存
+
+用法: python benchmarks/bench_projection.py [--rows 50000] [--sqlite bench.db]
+--rows 大于 0 时先写入测试数据 (FileHash 以 bench 开头)，结束后自动删除；
+指定 --sqlite 时改用本地 SQLite 文件
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import DB_CONFIG, PROJECTIONS
+from utils.database import _read_photos, bulk_save_to_db
+from bench_db import fake_records, cleanup
+
+
+def measure(columns):
+    start = time.perf_counter()
+    df = _read_photos(tuple(columns) if columns else None)
+    elapsed = time.perf_counter() - start
+    return len(df), len(df.columns), elapsed, df.memory_usage(deep=True).sum()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--sqlite", default=None, help="改用该 SQLite 文件作为存储后端")
+    args = ap.parse_args()
+
+    if args.sqlite:
+        DB_CONFIG['backend'] = 'sqlite'
+        DB_CONFIG['sqlite_path'] = args.sqlite
+
+    try:
+        if args.rows > 0:
+            records = fake_records(args.rows)
+            for i, item in enumerate(records):
+                # 补上实际数据中常见的长字符串列
+                item['FullPath'] = f"D:\\Project\\2024_Mission\\Area_{i % 50:02d}\\DJI_202405061200_{i:06d}_V.JPG"
+                item['DroneSerialNumber'] = "1581F5FHD23A0000ABCD"
+                item['CameraSerialNumber'] = "1ZNBJAB0010000"
+                item['FlightLineInfo'] = "7a1bce2c-5c8e-4a1f-9b2a-0f5e7c3d9a11"
+            bulk_save_to_db(records, raise_on_error=True)
+
+        base = measure(None)
+        print(f"{'全部列':12s} | {base[0]:8d} 行 {base[1]:3d} 列 | {base[2] * 1000:8.1f} ms | "
+              f"{base[3] / 1024 ** 2:8.1f} MB")
+        for name, columns in PROJECTIONS.items():
+            if not columns: continue
+            rows, cols, elapsed, mem = measure(columns)
+            print(f"{name:12s} | {rows:8d} 行 {cols:3d} 列 | {elapsed * 1000:8.1f} ms | {mem / 1024 ** 2:8.1f} MB "
+                  f"(内存 {base[3] / mem:.1f}x 更少)")
+    finally:
+        if args.rows > 0:
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
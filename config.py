@@ -1,10 +1,21 @@
 
 # ================= 配置区域 =================
 DB_CONFIG = {
+    'backend': 'mysql',          # 'mysql' / 'sqlite' (本地单文件数据库，无需数据库服务)
     'host': '',
     'user': '',
     'password': '',
-    'database': ''
+    'database': '',
+    'sqlite_path': 'dji_drone.db'  # backend 为 sqlite 时使用的数据库文件
+}
+
+# 数据库连接池
+POOL_CONFIG = {
+    'pool_name': 'dji_pool',
+    'pool_size': 10,          # 池中连接数 (mysql-connector 上限 32)，按同时操作的人数调整
+    'timeout': 10,            # 连接全部借出时最多等待的秒数
+    'retry_interval': 0.05,   # 等待期间的重试间隔 (秒)
+    'health_check': True,     # 取出连接时先 ping，断线则自动重连
 }
 
 API_KEY = ""
@@ -65,4 +76,38 @@ COLUMN_MAPPING = {  # 左边是数据库字段，右边展示的中文
 }
 
 # 反向映射（用于通过中文找回英文列名）
-REVERSE_MAPPING = {v: k for k, v in COLUMN_MAPPING.items()}
\ No newline at end of file
+REVERSE_MAPPING = {v: k for k, v in COLUMN_MAPPING.items()}
+
+# 各页面需要读取的列 (None 表示全部列)，按需读取可以大幅减少传输量和内存
+PROJECTIONS = {
+    # 地图打点：坐标 + 弹窗信息
+    'map': ['id', 'filename', 'capture_time', 'GpsLatitude', 'GpsLongitude', 'AbsoluteAltitude', 'RtkFlag',
+            'FlightLineInfo', 'DroneSerialNumber'],  # RtkFlag 用于密度网格，后两列用于航线轨迹分组
+    # 地图框选结果明细
+    'map_detail': ['id', 'filename', 'capture_time', 'FolderName', 'DroneModel', 'GpsLatitude', 'GpsLongitude',
+                   'AbsoluteAltitude', 'RelativeAltitude', 'RtkFlag', 'mark_note', 'FullPath'],
+    # CSV 导出保留全部字段
+    'export': None,
+}
+
+# 批量入库引擎参数
+INGEST_CONFIG = {
+    'workers': 8,            # 并行解析的 worker 数量
+    'executor': 'thread',    # 'thread' 线程池 / 'process' 进程池
+    'queue_size': 500,       # 解析结果队列上限 (背压)，写库跟不上时解析端会等待
+    'batch_size': 500,       # 每批写库的记录数 (一条多行 INSERT)
+    'hash_mode': 'full',     # 'full' 完整 MD5 / 'tiered' 先用首尾快速指纹，碰撞时再算完整 MD5
+}
+
+# 地图页参数
+MAP_CONFIG = {
+    'max_points': 50000,     # 视野内默认最多展示的点数，超过时按空间均匀抽稀 (每次平移 / 缩放都会重新渲染)
+    'viewport_margin': 0.5,  # 按视野查询时四周外扩的比例，在外扩范围内平移不重新查询
+    'marker_radius_m': 100,  # 标记点工具的默认检索半径 (米)
+    'track_gap_s': 300,      # 航线轨迹中相邻两张照片间隔超过该秒数时断开
+    'track_tolerance_px': 2,  # 航线轨迹抽稀的容差 (屏幕像素)，按缩放级别换算成经纬度
+    'track_min_zoom': 11,    # 航线轨迹模式下，缩放到该级别及以上才连线，更小时显示密度网格
+    'grid_zooms': [3, 5, 7, 9, 11, 13],  # 密度网格的层级 (对应地图缩放级别)，修改后需重建汇总数据
+    'raw_points_zoom': 14,   # 自动模式下，缩放到该级别及以上才显示原始点，更小时显示密度网格
+    'max_cells': 5000,       # 一次最多画的格子数，超过时改用更粗的一层
+}
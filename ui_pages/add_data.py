@@ -1,9 +1,13 @@
 import streamlit as st
 import os
+import time
 
+from config import INGEST_CONFIG
 
 from utils.parser import parse_dji_metadata
-from utils.database import save_to_db, sync_dir_tags, clear_all_data
+from utils.database import clear_all_data, complete_file_hashes, get_pool_stats, rebuild_summaries, backfill_folders
+from utils.ingest import IngestEngine, scan_files, filter_changed
+from utils.common import format_size
 
 
 def single_parser():
@@ -53,59 +57,95 @@ def multi_parser():
     else:
         target_exts = ('.jpg', '.jpeg', '.mp4', '.mov')
 
+    workers = st.number_input("并行解析数量", min_value=1, max_value=64,
+                              value=INGEST_CONFIG['workers'], step=1)
+    incremental = st.checkbox("增量扫描 (跳过上次入库后未变化的文件)", value=True)
+    hash_label = st.radio(
+        "去重方式：",
+        ("完整 MD5", "快速指纹 (大视频推荐，碰撞时再计算完整 MD5)"),
+        index=0 if INGEST_CONFIG['hash_mode'] == 'full' else 1,
+        horizontal=True
+    )
+    hash_mode = 'full' if hash_label == "完整 MD5" else 'tiered'
+
     if st.button("开始扫描并入库"):
         if not os.path.exists(working_path):
             st.error("路径不存在！")
         else:
             st.info(f"正在扫描: {working_path} ...")
-            all_files = []
-            for root, dirs, files in os.walk(working_path):
-                for f in files:
-                    if f.lower().endswith(target_exts):
-                        all_files.append(os.path.join(root, f))
-
+            scanned = scan_files(working_path, target_exts)
+            if incremental:
+                # 只打开新增或大小/修改时间变化的文件，其余仅靠 stat 判断即可跳过
+                to_parse = filter_changed(working_path, scanned)
+                st.write(f"发现 {len(scanned)} 个文件，其中 {len(to_parse)} 个为新增或已变化，"
+                         f"跳过 {len(scanned) - len(to_parse)} 个未变化文件。")
+            else:
+                to_parse = scanned
+                st.write(f"发现 {len(scanned)} 个文件。")
+
+            all_files = [item[0] for item in to_parse]
+            stat_map = {item[0]: (item[1], item[2]) for item in to_parse}
             total = len(all_files)
-            st.write(f"发现 {total} 个文件。")
 
             progress_bar = st.progress(0)
             status_text = st.empty()
 
-            batch_data = []
-            success_count = 0
-
-            for i, full_path in enumerate(all_files):
-                # 这里的 open 逻辑需要适配
-                try:
-                    with open(full_path, 'rb') as f:
-                        meta = parse_dji_metadata(f, os.path.basename(full_path), full_path=full_path)
-                        if meta:
-                            batch_data.append(meta)
-
-                            sync_dir_tags(full_path)
-                except:
-                    pass
-
-                # 批量入库
-                if len(batch_data) >= 50:
-                    count = save_to_db(batch_data)
-                    success_count += count
-                    batch_data = []
-
-                # 更新进度
-                progress = (i + 1) / total
-                progress_bar.progress(progress)
-                status_text.text(f"正在处理 ({i + 1}/{total}): {os.path.basename(full_path)}")
-
-            # 剩余入库
-            if batch_data:
-                count = save_to_db(batch_data)
-                success_count += count
-
-            st.success(f"🎉 全部完成！共成功入库 {success_count} 条记录。")
+            # 解析和写库都在后台引擎中进行，这里只根据引擎计数刷新进度
+            engine = IngestEngine(all_files, workers=workers, stat_map=stat_map, hash_mode=hash_mode).start()
+            while engine.is_running():
+                snap = engine.snapshot()
+                progress_bar.progress(snap['done'] / total if total else 1.0)
+                status_text.text(f"正在处理 ({snap['done']}/{total}): {snap['last_file']}  "
+                                 f"| {snap['files_per_sec']:.1f} 个/秒 | 待写库 {snap['queued']}")
+                time.sleep(0.3)
+            engine.join()
+
+            snap = engine.snapshot()
+            progress_bar.progress(1.0)
+            status_text.text(f"处理完成 ({snap['done']}/{total})，用时 {snap['elapsed']:.1f} 秒")
+            if engine.error:
+                st.error(f"入库中断: {engine.error}")
+            if snap['last_error']:
+                st.error(f"{snap['failed']} 个文件解析失败，最近一次错误: {snap['last_error']}")
+            success_count = snap['inserted']
+
+            st.success(f"🎉 全部完成！共成功入库 {success_count} 条记录，跳过已存在的 {snap['skipped']} 条。")
+            st.caption(f"读盘统计：{snap['parsed']} 个文件，读取 {format_size(snap['bytes_read'])}，"
+                       f"为文件总大小的 {snap['read_ratio']:.2f}x")
 
     st.sidebar.markdown("---")
     st.sidebar.header("数据库管理")
 
+    with st.sidebar.expander("🧮 补全完整哈希", expanded=False):
+        st.caption("快速指纹模式入库的文件尚未计算完整 MD5，可在空闲时补全，补全时会自动删除重复文件。")
+        if st.button("开始补全", use_container_width=True):
+            hash_status = st.empty()
+            totals = {'updated': 0, 'duplicates': 0, 'unreadable': 0}
+            last_id = 0
+            while True:
+                result = complete_file_hashes(after_id=last_id)
+                for k in totals:
+                    totals[k] += result[k]
+                hash_status.text(f"已补全 {totals['updated']}，删除重复 {totals['duplicates']}，"
+                                 f"无法读取 {totals['unreadable']}，剩余 {result['remaining']}")
+                if result['last_id'] == last_id or result['remaining'] == 0:
+                    break
+                last_id = result['last_id']
+
+    with st.sidebar.expander("🧾 重建汇总数据", expanded=False):
+        st.caption("目录编号和筛选项汇总在入库和删除时自动更新。旧库升级或直接改过数据库后，可在此按全表重新生成。")
+        if st.button("开始重建", use_container_width=True):
+            with st.spinner("正在统计..."):
+                filled = backfill_folders()
+                if filled is not None and rebuild_summaries():
+                    st.success(f"汇总数据已重建，补齐了 {filled} 条记录的目录编号")
+
+    with st.sidebar.expander("🔌 连接池状态", expanded=False):
+        pool_stats = get_pool_stats()
+        st.caption(f"连接数 {pool_stats['pool_size']}，累计取用 {pool_stats['checkouts']} 次，"
+                   f"排队 {pool_stats['waits']} 次，超时 {pool_stats['timeouts']} 次，重连 {pool_stats['reconnects']} 次")
+        st.caption(f"平均等待 {pool_stats['avg_wait_ms']:.1f} ms，最长等待 {pool_stats['max_wait_ms']:.1f} ms")
+
     with st.sidebar.expander("🗑️ 清空数据库", expanded=False):
         st.warning("⚠️ 警告：此操作将 **永久删除** 数据库中的所有照片记录，且 **无法恢复**！")
 
@@ -116,7 +156,5 @@ def multi_parser():
                 with st.spinner("正在销毁数据..."):
                     if clear_all_data():
                         st.success("数据库已清空！")
-                        import time
-
                         time.sleep(1)  # 停顿一下让用户看到成功提示
                         st.rerun()  # 刷新页面
\ No newline at end of file
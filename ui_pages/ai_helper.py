@@ -4,7 +4,7 @@ from datetime import datetime
 
 from utils.database import execute_raw_sql
 from utils.llm import generate_sql_from_ai
-from config import API_BASE, API_KEY
+from config import API_BASE, API_KEY, DB_CONFIG
 
 
 def ai_helper():
@@ -16,7 +16,7 @@ def ai_helper():
     if sub_mode == "🛠️ SQL手动查询":
         #st.markdown("### 👨‍💻 SQL控制台")
         result_container = st.container()
-        st.caption("在此处输入标准的 MySQL 查询语句。")
+        st.caption(f"在此处输入标准的 {'SQLite' if DB_CONFIG.get('backend') == 'sqlite' else 'MySQL'} 查询语句。")
 
         # 布局：左边是输入框，右边是表结构参考 (防忘词)
         col_edit, col_schema = st.columns([3, 1])
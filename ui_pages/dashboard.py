@@ -2,16 +2,18 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 
-from utils.database import load_data_from_db
+from utils.query import photo_columns, query_facets, query_kpis, query_range, query_page, query_photos, build_where
 from utils.common import format_size
-from config import COLUMN_MAPPING, REVERSE_MAPPING
+from config import COLUMN_MAPPING, REVERSE_MAPPING, PROJECTIONS
+
+PAGE_SIZE_OPTIONS = [100, 200, 500, 1000]
 
 def dashboard():
 
     try:
-        df = load_data_from_db()
-        # 确保时间列格式正确
-        df['capture_time'] = pd.to_datetime(df['capture_time'])
+        # 只取下拉选项和时间范围，明细按筛选条件分页查询
+        facets = query_facets()
+        all_cols = photo_columns()
     except Exception as e:
         st.error("无法连接数据库，请检查配置。")
         st.stop()
@@ -20,16 +22,13 @@ def dashboard():
     st.sidebar.markdown("---")
     st.sidebar.header("基础筛选")
 
-    if 'FolderName' in df.columns:
-        # 获取列表并去重
-        all_folders = list(df['FolderName'].dropna().unique())
-        all_folders.sort()
-
+    if 'FolderName' in all_cols:
+        all_folders = facets['folders']
         folder_filter = st.sidebar.multiselect("📂 来源文件夹", all_folders, placeholder="全部文件夹")
     else:
         folder_filter = []
 
-    available_types = list(df['FileType'].dropna().unique())
+    available_types = facets['types']
     selected_types = st.sidebar.multiselect(
         "🗃️ 文件类型筛选",
         options=available_types,
@@ -38,60 +37,34 @@ def dashboard():
     search_txt = st.sidebar.text_input("按备注信息搜索")
     
 
-    min_date = df['capture_time'].min().date() if not df.empty else datetime.today().date()
-    max_date = df['capture_time'].max().date() if not df.empty else datetime.today().date()
+    min_date = facets['min_time'].date() if not pd.isna(facets['min_time']) else datetime.today().date()
+    max_date = facets['max_time'].date() if not pd.isna(facets['max_time']) else datetime.today().date()
     date_range = st.sidebar.date_input("📅 拍摄日期 ", (min_date, max_date))
     include_none_date = st.sidebar.checkbox(
         "包含无时间数据",
         value=True
     )
 
-    models = ["全部"] + list(df['DroneModel'].dropna().unique())
+    models = ["全部"] + facets['models']
     model_filter = st.sidebar.selectbox("🚁 机型", models)
 
-    versions = ["全部"] + list(df['Version'].dropna().unique())
+    versions = ["全部"] + facets['versions']
     version_filter = st.sidebar.selectbox("⚙ 版本", versions)
 
     rtk_filter = st.sidebar.radio("📡 RTK状态", ["全部", "固定解 (Fixed)", "非固定解"])
 
-    # --- 应用基础筛选 ---
-    df_filtered = df.copy()
-
-    if isinstance(date_range, tuple) and len(date_range) == 2:
-        if include_none_date:
-            df_filtered = df_filtered[
-                ((df_filtered['capture_time'].dt.date >= date_range[0]) &
-                    (df_filtered['capture_time'].dt.date <= date_range[1])) |
-                df_filtered['capture_time'].isna()
-                ]
-        else:
-            df_filtered = df_filtered[
-                (df_filtered['capture_time'].dt.date >= date_range[0]) &
-                (df_filtered['capture_time'].dt.date <= date_range[1])
-                ]
-
-    if selected_types:
-        df_filtered = df_filtered[df_filtered['FileType'].isin(selected_types)]
-    
-    if search_txt:
-        df_filtered = df_filtered[
-            #df_filtered['filename'].str.contains(search_txt, case=False, na=False) | 
-            df_filtered['mark_note'].str.contains(search_txt, case=False, na=False)
-        ]
-
-    if model_filter != "全部":
-        df_filtered = df_filtered[df_filtered['DroneModel'] == model_filter]
-
-    if version_filter != "全部":
-        df_filtered = df_filtered[df_filtered['Version'] == version_filter]
-
-    if rtk_filter == "固定解 (Fixed)":
-        df_filtered = df_filtered[df_filtered['RtkFlag'] == 50]
-    elif rtk_filter == "非固定解":
-        df_filtered = df_filtered[df_filtered['RtkFlag'] != 50]
-
-    if folder_filter:
-        df_filtered = df_filtered[df_filtered['FolderName'].isin(folder_filter)]
+    # --- 汇总为筛选条件，由数据库执行 ---
+    filters = {
+        'folders': folder_filter,
+        'types': selected_types,
+        'date_range': date_range if isinstance(date_range, tuple) and len(date_range) == 2 else None,
+        'include_none_date': include_none_date,
+        'model': None if model_filter == "全部" else model_filter,
+        'version': None if version_filter == "全部" else version_filter,
+        'rtk': {"固定解 (Fixed)": 'fixed', "非固定解": 'not_fixed'}.get(rtk_filter),
+        'note': search_txt,
+        'ranges': {},
+    }
 
     # 顶部UI
 
@@ -141,13 +114,14 @@ def dashboard():
                 col_name = numeric_columns[label]
 
                 # 检查该列是否存在于数据中 (防止数据库缺字段报错)
-                if col_name not in df_filtered.columns:
+                if col_name not in all_cols:
                     st.warning(f"数据库中缺少字段：{col_name}，跳过筛选。")
                     continue
 
-                # 获取当前数据的最大最小值，作为默认参考
-                curr_min = float(df_filtered[col_name].min()) if not df_filtered.empty else 0.0
-                curr_max = float(df_filtered[col_name].max()) if not df_filtered.empty else 100.0
+                # 获取当前筛选结果的最大最小值，作为默认参考
+                lo, hi = query_range(filters, col_name)
+                curr_min = float(lo) if not pd.isna(lo) else 0.0
+                curr_max = float(hi) if not pd.isna(hi) else 100.0
 
                 with cols[i % 2]:
                     st.markdown(f"**{label}**")
@@ -170,33 +144,33 @@ def dashboard():
                 # with c3:
                 #    val_max = st.number_input(f"最大 {label}", value=current_max, key=f"max_{col_name}")
 
-                # --- 立即执行筛选逻辑 ---
-                df_filtered = df_filtered[
-                    (df_filtered[col_name] >= val_min) &
-                    (df_filtered[col_name] <= val_max)
-                    ]
+                # --- 加入筛选条件 ---
+                filters['ranges'][col_name] = (val_min, val_max)
             st.markdown("---")
 
-    kpi1.metric("📸 筛选结果", f"{len(df_filtered)} 张")
-
-    total_size = df_filtered['FileSize'].sum() if 'FileSize' in df_filtered.columns else 0
-    kpi2.metric("💾 占用空间", format_size(total_size))
-
-    kpi3.download_button(
-        label="📥 导出数据 (CSV)",
-        data=df_filtered.to_csv(index=False).encode('utf-8-sig'),
-        file_name=f'dji_filter_result.csv',
-        mime='text/csv'
-    )
+    kpis = query_kpis(filters)
+    kpi1.metric("📸 筛选结果", f"{kpis['count']} 张")
+    kpi2.metric("💾 占用空间", format_size(kpis['total_size']))
+
+    # 导出需要取全部明细，点击后才查询
+    filter_key = repr(build_where(filters))
+    if st.session_state.get('dashboard_export_key') == filter_key:
+        kpi3.download_button(
+            label="📥 下载 CSV",
+            data=query_photos(filters, PROJECTIONS['export']).to_csv(index=False).encode('utf-8-sig'),
+            file_name=f'dji_filter_result.csv',
+            mime='text/csv'
+        )
+    elif kpi3.button("📥 导出数据 (CSV)", use_container_width=True):
+        st.session_state['dashboard_export_key'] = filter_key
+        st.rerun()
 
     if kpi4.button("🗺️ 同步筛选结果到地图", use_container_width=True):
-        st.session_state['shared_map_data'] = df_filtered
+        st.session_state['shared_map_data'] = query_photos(filters, PROJECTIONS['map'])
         st.toast("✅ 数据已同步！请点击左侧侧边栏切换到 '遥感采样点地图' 查看。", icon="🚀")
 
     # ================= 4. 数据表格 =================
     # st.subheader(f"📄 数据明细")
-    # 获取所有可用列
-    all_cols = list(df.columns)
     # 定义默认列
     # default_cols = [
     #    'filename', 'capture_time', 'FileSize', 'Version', 'ImageSource', 'DroneModel', 'DroneSerialNumber',
@@ -246,15 +220,38 @@ def dashboard():
             default=default_display_options
         )
 
-    # 渲染表格
-    if not df_filtered.empty:
+    # 渲染表格 (按 capture_time 倒序键集分页，每次只取一页)
+    if kpis['count'] > 0:
         final_db_cols = []
         for c_cn in selected_display_cols:
             c_en = REVERSE_MAPPING.get(c_cn, c_cn)
-            if c_en in df_filtered.columns:
+            if c_en in all_cols:
                 final_db_cols.append(c_en)
 
-        display_df = df_filtered[final_db_cols].copy()
+        col_size, col_prev, col_page, col_next = st.columns([1, 1, 2, 1])
+        page_size = col_size.selectbox("每页条数", PAGE_SIZE_OPTIONS, index=1, label_visibility="collapsed")
+
+        # 筛选条件或每页条数变化时回到第一页；cursors 记录每一页的起始游标
+        paging_key = (filter_key, page_size)
+        paging = st.session_state.get('dashboard_paging')
+        if not paging or paging['key'] != paging_key or (len(paging['cursors']) - 1) * page_size >= kpis['count']:
+            paging = {'key': paging_key, 'cursors': [None]}
+            st.session_state['dashboard_paging'] = paging
+        page_no = len(paging['cursors']) - 1
+
+        page_df, next_cursor = query_page(filters, final_db_cols, page_size=page_size, cursor=paging['cursors'][-1])
+        page_count = (kpis['count'] + page_size - 1) // page_size
+        col_page.caption(f"第 {page_no + 1} / {page_count} 页")
+
+        if col_prev.button("⬅️ 上一页", disabled=page_no == 0, use_container_width=True):
+            paging['cursors'].pop()
+            st.rerun()
+        if col_next.button("下一页 ➡️", disabled=next_cursor is None, use_container_width=True):
+            paging['cursors'].append(next_cursor)
+            st.rerun()
+
+        display_df = page_df[final_db_cols].copy()
+        display_df.index = range(page_no * page_size, page_no * page_size + len(display_df))
 
         if 'FileSize' in display_df.columns:
             display_df['FileSize'] = display_df['FileSize'].apply(format_size)
@@ -272,4 +269,4 @@ def dashboard():
             hide_index=False,  # 显示索引
         )
     else:
-        st.warning("当前筛选条件下没有数据。")
\ No newline at end of file
+        st.warning("当前筛选条件下没有数据。")
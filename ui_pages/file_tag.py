@@ -1,12 +1,11 @@
 import streamlit as st
 import pandas as pd
-import mysql.connector
 from datetime import datetime
 import time
 
-from config import DB_CONFIG
-from utils.database import update_color_by_hashes, update_marks_batch
-from utils.common import color_wash, standardize_color
+from utils.database import get_connection, update_color_by_hashes, update_marks_batch
+from utils.query import query_facets
+from utils.common import color_wash, standardize_color, format_size
 
 TAG_OPTIONS = [
         "⚪",
@@ -16,10 +15,55 @@ TAG_OPTIONS = [
         "🔵"
 ]
 
+STAT_COLUMNS = ['照片数', '视频数', '总大小', '拍摄时间', 'RTK固定解', '机型']
+
+def _add_folder_stats(df_tags, df_models):
+    """
+    把 folder_stats / folder_models 的统计整理成展示列
+    """
+    df = df_tags.copy()
+    df['照片数'] = df['photo_cnt'].fillna(0).astype(int)
+    df['视频数'] = df['video_cnt'].fillna(0).astype(int)
+    df['总大小'] = df['total_bytes'].apply(lambda v: format_size(v) if pd.notna(v) else "")
+    min_time = pd.to_datetime(df['min_time']).dt.strftime('%Y-%m-%d')
+    max_time = pd.to_datetime(df['max_time']).dt.strftime('%Y-%m-%d')
+    df['拍摄时间'] = (min_time + " ~ " + max_time).where(min_time != max_time, min_time).fillna("")
+    df['RTK固定解'] = (df['rtk_fixed_cnt'] / df['photo_cnt'].where(df['photo_cnt'] > 0) * 100).round(1)
+    models = df_models.groupby('folder_id')['model'].agg(', '.join)
+    df['机型'] = df['folder_id'].map(models).fillna("")
+    return df.drop(columns=['folder_id', 'file_cnt', 'photo_cnt', 'video_cnt', 'total_bytes', 'min_time', 'max_time',
+                            'rtk_fixed_cnt'])
+
+def _changed_rows(edited_df, df_display):
+    """
+    与加载时的快照逐行比对，只留下标记或备注真正改过的行
+    """
+    color_changed = edited_df['tag_color'] != df_display['tag_color']
+    note_changed = edited_df['mark_note'].fillna("") != df_display['mark_note']
+    return edited_df[color_changed | note_changed]
+
+def _save_marks(df_changes, mode):
+    if df_changes.empty:
+        st.info("没有需要保存的修改。")
+        return
+    st.session_state['file_tag_outcomes'] = update_marks_batch(df_changes, mode)
+    # 表格重新按数据库内容加载，清掉编辑器里记录的修改
+    st.session_state.pop('color_tag_editor', None)
+    st.rerun()
+
 def file_tag():
     #st.subheader("🗂️ 目录层级标记管理")
+
+    # 上一次保存的逐行结果
+    outcomes = st.session_state.pop('file_tag_outcomes', None)
+    if outcomes:
+        df_outcomes = pd.DataFrame(outcomes).rename(
+            columns={'full_path': '目录', 'result': '结果', 'files': '同步文件数'})
+        failed = (df_outcomes['结果'] != "已保存").sum()
+        with st.expander(f"上次保存：{len(df_outcomes)} 个目录，{failed} 个未保存", expanded=bool(failed)):
+            st.dataframe(df_outcomes, hide_index=True, use_container_width=True)
     
-    conn = mysql.connector.connect(**DB_CONFIG)
+    conn = get_connection()
     sql = """
     SELECT
         folder_name, 
@@ -28,13 +72,30 @@ def file_tag():
         t.dir_level_2 AS '二级目录',
         t.dir_level_3 AS '三级目录',
         t.tag_color,
-        t.mark_note
+        t.mark_note,
+        t.folder_id,
+        s.file_cnt,
+        s.photo_cnt,
+        s.video_cnt,
+        s.total_bytes,
+        s.min_time,
+        s.max_time,
+        s.rtk_fixed_cnt
     FROM file_dir_tags t
+    LEFT JOIN folder_stats s ON s.folder_id = t.folder_id
     ORDER BY t.updated_at DESC
     LIMIT 2000;
     """
-    df_tags = pd.read_sql(sql, conn)
-    conn.close()
+    try:
+        df_tags = pd.read_sql(sql, conn)
+        # 目录内的机型 (预先汇总，不扫照片表)
+        folder_ids = [int(i) for i in df_tags['folder_id'].dropna().unique()]
+        df_models = pd.read_sql(
+            f"SELECT folder_id, model FROM folder_models WHERE folder_id IN ({', '.join(['%s'] * len(folder_ids))}) "
+            "ORDER BY model", conn, params=folder_ids
+        ) if folder_ids else pd.DataFrame(columns=['folder_id', 'model'])
+    finally:
+        conn.close()
 
     if df_tags.empty:
         st.warning("暂无数据。")
@@ -42,6 +103,10 @@ def file_tag():
 
     df_tags['tag_color'] = df_tags['tag_color'].fillna("⚪")
     df_tags['mark_note'] = df_tags['mark_note'].fillna("")
+    df_tags = _add_folder_stats(df_tags, df_models)
+
+    # 目录层级选项来自汇总表，不再对整张表去重
+    facets = query_facets()
 
     c1, c2, c3, c4, c5= st.columns([1, 1, 1, 1, 1])
     
@@ -54,17 +119,17 @@ def file_tag():
         )
     with c2:
         # 获取去重后的列表
-        all_l2_dirs = list(df_tags['一级目录'].dropna().unique())
+        all_l2_dirs = list(facets['dir1'])
         all_l2_dirs.sort()
         filter_l2_dirs = st.multiselect("📂 按一级目录筛选", all_l2_dirs)
 
     with c3:
-        all_l3_dirs = list(df_tags['二级目录'].dropna().unique())
+        all_l3_dirs = list(facets['dir2'])
         all_l3_dirs.sort()
         filter_l3_dirs = st.multiselect("🗂️ 按二级目录筛选", all_l3_dirs)
     
     with c4:
-        all_l4_dirs = list(df_tags['三级目录'].dropna().unique())
+        all_l4_dirs = list(facets['dir3'])
         all_l4_dirs.sort()
         filter_l4_dirs = st.multiselect("🗂️ 按三级目录筛选", all_l4_dirs)
 
@@ -101,6 +166,7 @@ def file_tag():
     #st.markdown("### 📝 状态管理")
     
 
+    btn = save_btn = resync_btn = False  # 筛选结果为空时不显示按钮
     if not df_display.empty:
         col_batch_1, col_batch_2, col_batch_3, col_batch_4, col_kpi = st.columns([2, 0.7, 0.95, 1, 2])
         col_batch_5, = st.columns([3])
@@ -114,6 +180,11 @@ def file_tag():
             #    index=0,
             #    key="batch_target_color"
             #)
+        with col_batch_1:
+            # 入库不会自动带上目录备注，新文件靠这里把当前显示的全部目录备注重新下发
+            resync_btn = st.button("重新同步全部备注", help="把当前显示的全部目录的备注重新写入其下 (含子目录) 的所有文件，"
+                                                        "新入库的文件需要执行一次才会带上备注")
+
         with col_batch_4:
             df_export = df_display[[
                 'full_path', 'folder_name', 'mark_note', 'tag_color', 
@@ -164,7 +235,7 @@ def file_tag():
                         # 执行更新
                         if st.button("🚀 确认覆盖并同步数据库"):
                             with st.spinner("正在批量解析并同步..."):
-                                update_marks_batch(df_upload, 2)
+                                st.session_state['file_tag_outcomes'] = update_marks_batch(df_upload, 2)
                                 st.success("导入完成！页面即将刷新...")
                                 time.sleep(1.5)
                                 st.rerun()
@@ -218,8 +289,9 @@ def file_tag():
             "一级目录": st.column_config.TextColumn(disabled=True),
             "二级目录": st.column_config.TextColumn(disabled=True),
             "三级目录": st.column_config.TextColumn(disabled=True),
+            "RTK固定解": st.column_config.NumberColumn(help="目录内照片中 RTK 固定解的比例 (视频不计)", format="%.1f%%"),
         },
-        disabled=["full_path", "filename", "根目录", "子目录", "任务目录"],
+        disabled=["full_path", "filename", "根目录", "子目录", "任务目录"] + STAT_COLUMNS,
         hide_index=True,
         use_container_width=True,
         height=600,
@@ -227,15 +299,17 @@ def file_tag():
     )
 
     # 4. 保存按钮
+    # 只提交改过的行
     if btn:
         with st.spinner("正在保存修改..."):
-            update_marks_batch(edited_df, 1)
-            st.rerun()
+            _save_marks(_changed_rows(edited_df, df_display), 1)
     if save_btn:
         with st.spinner("正在更新数据库..."):
-            update_marks_batch(edited_df, 2)
+            _save_marks(_changed_rows(edited_df, df_display), 2)
+    if resync_btn:
+        with st.spinner("正在重新同步全部备注..."):
+            _save_marks(edited_df, 2)
             #target_hashes = df_display['file_hash'].tolist()
             #select_btn = False
             
-            #update_color_by_hashes(target_hashes, target_color)
-            st.rerun() # 刷新看结果
\ No newline at end of file
+            #update_color_by_hashes(target_hashes, target_color)
\ No newline at end of file
@@ -20,8 +20,7 @@ import time
 import openpyxl
 from streamlit_option_menu import option_menu
 
-from config import DB_CONFIG
-from utils.database import process_excel_to_db
+from utils.database import get_connection, process_excel_to_db
 
 def flight_task():
     #st.subheader("⏱️ 飞行任务时长数据库")
@@ -35,14 +34,16 @@ def flight_task():
         if confirm_check:
             if st.button("🔴 立即清空所有数据", type="primary", use_container_width=True):
                 with st.spinner("正在销毁数据..."):
+                    conn = None
                     try:
-                        conn = mysql.connector.connect(**DB_CONFIG)
+                        conn = get_connection()
                         cursor = conn.cursor()
                         cursor.execute("TRUNCATE TABLE task_hours")
                         conn.commit()
-                        conn.close()
                     except Exception as e:
                         st.error(f"清空失败: {e}")
+                    finally:
+                        if conn: conn.close()
 
                     import time
                     time.sleep(1)  # 停顿一下让用户看到成功提示
@@ -59,11 +60,13 @@ def flight_task():
     st.divider()
     st.subheader("📊 历史飞行任务数据")
 
-    conn = mysql.connector.connect(**DB_CONFIG)
+    conn = get_connection()
     if conn:
         # 读取数据
-        df_tasks = pd.read_sql("SELECT * FROM task_hours ORDER BY created_at DESC", conn)
-        conn.close()
+        try:
+            df_tasks = pd.read_sql("SELECT * FROM task_hours ORDER BY created_at DESC", conn)
+        finally:
+            conn.close()
 
         if not df_tasks.empty:
             # 简单统计
@@ -1,10 +1,176 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from streamlit_folium import st_folium
-from folium.plugins import Draw, MarkerCluster
+from folium.plugins import Draw, FastMarkerCluster
 
-from utils.database import load_data_from_db
+from utils.database import RTK_FIXED
+from utils.query import (query_in_shapes, query_in_bounds, query_density, query_rows_by_ids, density_levels,
+                         parse_shapes)
+from utils.geo import (grid_cell_size, grid_cells, view_bounds, expand_bounds, bounds_contain, thin_points,
+                       simplify_line, PointIndex)
+from config import PROJECTIONS, MAP_CONFIG
+
+# 浏览器端为每一行 [纬度, 经度, 文件名, 高度] 创建圆点；提示和弹窗在第一次悬停 / 点击时才生成
+POINT_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: __RADIUS__, color: 'red', fill: true, fillColor: 'red', fillOpacity: 0.7
+    });
+    marker.once('mouseover', function () {
+        this.bindTooltip(String(row[2])).openTooltip();
+    });
+    marker.on('click', function () {
+        if (this.getPopup()) return;
+        var div = document.createElement('div');
+        var name = document.createElement('b');
+        name.textContent = row[2];
+        div.appendChild(name);
+        div.appendChild(document.createElement('br'));
+        div.appendChild(document.createTextNode('高度: ' + row[3] + 'm'));
+        this.bindPopup(div).openPopup();
+    });
+    return marker;
+}
+"""
+
+# 航线轨迹的配色，按航线依次轮换
+TRACK_COLORS = ['#e6194b', '#3cb44b', '#4363d8', '#f58231', '#911eb4', '#42d4f4', '#f032e6', '#469990']
+
+# 密度网格按点数的对数分档着色 (由浅到深)
+DENSITY_COLORS = ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#f03b20', '#bd0026']
+
+
+def _grid_from_points(map_df, zoom):
+    """
+    筛选结果没有预先汇总的网格，按同样的分箱规则在内存中计算，返回 (层级, 格子 DataFrame)
+    数据中没有 RtkFlag 列时 (旧会话同步的数据) RTK 固定解数记为空，不当作 0
+    """
+    has_rtk = 'RtkFlag' in map_df.columns
+    rtk = map_df['RtkFlag'] == RTK_FIXED if has_rtk else np.zeros(len(map_df))
+    alts = map_df['AbsoluteAltitude'] if 'AbsoluteAltitude' in map_df.columns else np.full(len(map_df), np.nan)
+    columns = ['level', 'cx', 'cy', 'cnt', 'alt_sum', 'alt_cnt', 'rtk_fixed_cnt']
+    for level in density_levels(zoom):
+        cells = pd.DataFrame(grid_cells(map_df['GpsLatitude'], map_df['GpsLongitude'], alts, rtk, [level]),
+                             columns=columns)
+        if len(cells) <= MAP_CONFIG['max_cells']:
+            break
+    if not has_rtk:
+        cells['rtk_fixed_cnt'] = np.nan
+    return level, cells.drop(columns='level')
+
+
+def _density_layer(cells, level):
+    """
+    把格子画成一个 GeoJSON 图层，悬停显示点数、平均高度和 RTK 固定解比例
+    """
+    size = grid_cell_size(level)
+    cnt = cells['cnt'].to_numpy(dtype=float)
+    shade = np.log1p(cnt) / np.log1p(cnt.max())
+    color_idx = np.minimum((shade * len(DENSITY_COLORS)).astype(int), len(DENSITY_COLORS) - 1)
+    mean_alt = (cells['alt_sum'] / cells['alt_cnt'].where(cells['alt_cnt'] > 0)).round(1)
+    rtk_share = (cells['rtk_fixed_cnt'] / cells['cnt'] * 100).round(1)
+
+    features = []
+    for cx, cy, n, alt, rtk, ci in zip(cells['cx'], cells['cy'], cnt, mean_alt, rtk_share, color_idx):
+        x0, y0 = cx * size, cy * size
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[x0, y0], [x0 + size, y0], [x0 + size, y0 + size],
+                                                             [x0, y0 + size], [x0, y0]]]},
+            'properties': {'cnt': int(n), 'mean_alt': None if pd.isna(alt) else float(alt),
+                           'rtk_share': None if pd.isna(rtk) else float(rtk), 'color': DENSITY_COLORS[ci]},
+        })
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name="密度网格",
+        style_function=lambda f: {'fillColor': f['properties']['color'], 'color': f['properties']['color'],
+                                  'weight': 0.5, 'fillOpacity': 0.6},
+        tooltip=folium.GeoJsonTooltip(fields=['cnt', 'mean_alt', 'rtk_share'],
+                                      aliases=['点数', '平均高度(m)', 'RTK固定解(%)']),
+    )
+
+
+def _view_points(map_df, load_bounds, budget=None):
+    """
+    视野 (外扩一圈) 内的点，返回 (DataFrame, 视野内总点数)
+    同步过来的筛选结果在内存中截取；全库按视野查询，超过 budget 时在数据库中先按网格抽样
+    """
+    if map_df is not None:
+        view_df = map_df[map_df['GpsLatitude'].between(load_bounds[0], load_bounds[2])
+                         & map_df['GpsLongitude'].between(load_bounds[1], load_bounds[3])]
+        return view_df, len(view_df)
+    return query_in_bounds(load_bounds, PROJECTIONS['map'], budget=budget)
+
+
+def _flight_tracks(view_df, zoom):
+    """
+    按航线 (FlightLineInfo，缺失时用无人机序列号) 分组，组内按拍摄时间排序，
+    相邻两张间隔超过 MAP_CONFIG['track_gap_s'] 秒时断开；每段按当前缩放级别做 Douglas-Peucker 抽稀
+    返回 [(名称, [[纬度, 经度], ...], 原始点数)]
+    """
+    df = view_df.dropna(subset=['capture_time'])
+    empty = pd.Series(None, index=df.index, dtype=object)
+    flight = df.get('FlightLineInfo', empty).fillna("")
+    serial = df.get('DroneSerialNumber', empty).fillna("未知")
+    label = ("航线 " + flight).where(flight != "", "无人机 " + serial)
+    df = df.assign(track=label, t=pd.to_datetime(df['capture_time'])).sort_values(['track', 't'], kind='stable')
+
+    gap = df['t'].diff().dt.total_seconds()
+    segment = ((df['track'] != df['track'].shift()) | (gap > MAP_CONFIG['track_gap_s'])).cumsum().to_numpy()
+    lats = df['GpsLatitude'].to_numpy(dtype=float)
+    lons = df['GpsLongitude'].to_numpy(dtype=float)
+    labels = df['track'].to_numpy()
+    # 容差取若干像素在当前缩放级别下对应的经度跨度
+    tolerance = MAP_CONFIG['track_tolerance_px'] * 360.0 / (256 * 2 ** zoom)
+
+    tracks = []
+    for idx in np.split(np.arange(len(df)), np.flatnonzero(np.diff(segment)) + 1):
+        if len(idx) < 2: continue  # 单张照片连不成线
+        keep = idx[simplify_line(lons[idx], lats[idx], tolerance)]
+        tracks.append((labels[idx[0]], np.column_stack([lats[keep], lons[keep]]).round(6).tolist(), len(idx)))
+    return tracks
+
+
+def _track_layer(tracks):
+    """
+    每段轨迹一条折线，同一航线同一颜色
+    """
+    layer = folium.FeatureGroup(name="航线轨迹")
+    colors = {}
+    for label, coords, n in tracks:
+        color = colors.setdefault(label, TRACK_COLORS[len(colors) % len(TRACK_COLORS)])
+        folium.PolyLine(coords, color=color, weight=3, opacity=0.8, tooltip=f"{label} ({n} 张)").add_to(layer)
+    return layer
+
+
+def _point_index(df, map_df):
+    """
+    同步过来的筛选结果建一次网格索引，存在会话中，换了一份数据才重建；返回 (索引, 各点的 id)
+    """
+    cached = st.session_state.get('map_point_index')
+    if cached is None or cached[0] is not df:
+        cached = (df, PointIndex(map_df['GpsLatitude'], map_df['GpsLongitude']), map_df['id'].to_numpy())
+        st.session_state['map_point_index'] = cached
+    return cached[1], cached[2]
+
+
+def _output_bounds(output):
+    """
+    st_folium 返回的视野转成 (南, 西, 北, 东)，没有时返回 None
+    """
+    bounds = output.get('bounds') or {}
+    south_west, north_east = bounds.get('_southWest') or {}, bounds.get('_northEast') or {}
+    if south_west.get('lat') is None or north_east.get('lat') is None:
+        return None
+    return south_west['lat'], south_west['lng'], north_east['lat'], north_east['lng']
+
+
+def _view_key(zoom):
+    # 缩放跨过原始点 / 航线轨迹阈值或换了网格层级时才需要重画
+    return (zoom >= MAP_CONFIG['raw_points_zoom'], zoom >= MAP_CONFIG['track_min_zoom'],
+            density_levels(zoom)[0])
 
 
 def render_map():
@@ -23,13 +189,10 @@ def render_map():
         data_source_text = "🔍 来自【数据查询】的筛选结果"
         is_filtered_view = True
     else:
-        # 如果没有，则加载全量数据库
-        try:
-            df = load_data_from_db()
-            data_source_text = "💾 全量数据库"
-            is_filtered_view = False
-        except:
-            st.stop()
+        # 如果没有，则使用全量数据库：不整表读取，只按当前视野查询
+        df = None
+        data_source_text = "💾 全量数据库"
+        is_filtered_view = False
 
     with st.sidebar.form(key='filter_form'):
         st.sidebar.markdown("---")
@@ -39,8 +202,19 @@ def render_map():
         # show_rtk_only = st.sidebar.checkbox("只显示 RTK 固定解", value=False)
         # map_style = st.sidebar.selectbox("地图风格", ["卫星/深色 (Satellite)", "街道/浅色 (Road)"])
         point_radius = st.sidebar.slider("轨迹点大小", 1, 20, 5)
+        display_mode = st.sidebar.radio("显示方式", ["自动", "密度网格", "原始点", "航线轨迹"], horizontal=True,
+                                        help="自动：缩小时显示密度网格，放大到一定级别后显示原始点；"
+                                             "航线轨迹：按航线把视野内的点连成折线")
+
+        max_points = st.sidebar.slider("视野内最多展示点数", 1000, 200000, MAP_CONFIG['max_points'], step=1000,
+                                       help="视野内的点超过该数量时，按空间均匀抽稀")
+        marker_radius = st.sidebar.number_input("标记点检索半径 (米)", 1, 100000, MAP_CONFIG['marker_radius_m'], step=50,
+                                                help="用标记点工具选点时，检索该半径内的数据")
 
-        # 2. 数据处理
+        submit_btn = st.form_submit_button(label='执行筛选',type="primary")
+
+    # 2. 数据处理
+    if is_filtered_view:
         map_df = df.copy()
         # if show_rtk_only:
         #    map_df = map_df[map_df['RtkFlag'] == 50]
@@ -48,34 +222,48 @@ def render_map():
         # 必须清除无效坐标
         map_df = map_df.dropna(subset=['GpsLatitude', 'GpsLongitude'])
         map_df = map_df[(map_df['GpsLatitude'] != 0) & (map_df['GpsLongitude'] != 0)]
+        total = len(map_df)
+    else:
+        try:
+            # 总点数和初始中心取自最粗一层密度网格
+            overview_level, overview = query_density(0)
+        except Exception as e:
+            st.error(f"读取地图数据失败: {e}")
+            st.stop()
+        total = int(overview['cnt'].sum())
 
-        max_points = st.sidebar.slider("展示数据点个数", 1, len(map_df), 2000)
-
-        submit_btn = st.form_submit_button(label='执行筛选',type="primary")
-
-    # max_points = 10000
-    if len(map_df) > max_points:
-        st.warning(f"数据量较大，仅显示前{max_points}个数据点")
-        map_df = map_df.head(max_points)
-
-    if map_df.empty:
+    if total == 0:
         st.warning("当前没有包含 GPS 坐标的照片数据。")
     else:
         # 3. 动态计算地图中心和缩放
         # 取平均值作为中心
-        mid_lat = map_df['GpsLatitude'].mean()
-        mid_lon = map_df['GpsLongitude'].mean()
-        if len(map_df) >= 50:
+        if is_filtered_view:
+            mid_lat = map_df['GpsLatitude'].mean()
+            mid_lon = map_df['GpsLongitude'].mean()
+        else:
+            size = grid_cell_size(overview_level)
+            mid_lat = float(((overview['cy'] + 0.5) * size * overview['cnt']).sum() / total)
+            mid_lon = float(((overview['cx'] + 0.5) * size * overview['cnt']).sum() / total)
+        if total >= 50:
             zoom_start = 10
-        elif len(map_df) >= 20:
+        elif total >= 20:
             zoom_start = 12
         else:
             zoom_start = 16
+        # 沿用上一次地图返回的视野，切换图层时不跳回初始位置
+        view = st.session_state.get('map_view')
+        if view:
+            mid_lat, mid_lon, zoom_start = view['center']['lat'], view['center']['lng'], view['zoom']
+        bounds = (view or {}).get('bounds') or view_bounds(mid_lat, mid_lon, zoom_start)
+        show_density = display_mode == "密度网格" or (
+            display_mode == "自动" and zoom_start < MAP_CONFIG['raw_points_zoom']) or (
+            display_mode == "航线轨迹" and zoom_start < MAP_CONFIG['track_min_zoom'])
 
         m = folium.Map(
             location=[mid_lat, mid_lon],
             zoom_start=zoom_start,
             control_scale=True,
+            prefer_canvas=True,  # 圆点画在 canvas 上，不为每个点创建 SVG 元素
             # 使用高德地图底图 (需要网络能访问高德)
             tiles='https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=7&x={x}&y={y}&z={z}',
             #tiles='CartoDB positron',
@@ -95,47 +283,66 @@ def render_map():
         #        tooltip=f"{row['filename']} (高度: {row['AbsoluteAltitude']}m)"
         #    ).add_to(m)
 
-        marker_cluster = MarkerCluster(name="聚合图层", disable_clustering_at_zoom=16).add_to(m)
-
-        points_data = map_df[['GpsLatitude', 'GpsLongitude', 'filename', 'AbsoluteAltitude']].values
-
-        # 循环添加点到聚合器
-        markers = []
-        for lat, lon, fname, alt in points_data:
-            popup_txt = f"<b>{fname}</b><br>高度: {alt}m"
-            
-            marker = folium.CircleMarker(
-                location=[lat, lon],
-                radius=5,           # 聚合展开后的点大小
-                color='red',
-                fill=True,
-                fill_color='red',
-                fill_opacity=0.7,
-                tooltip=fname,      # 鼠标悬停显示文件名
-                popup=popup_txt
-            )
-            markers.append(marker)
-
+        # 只处理视野 (外扩一圈) 内的数据，在外扩范围内平移不重新查询
+        load_bounds = expand_bounds(bounds, MAP_CONFIG['viewport_margin'])
+        if show_density:
+            # 全库用入库时维护好的 density_grid，筛选结果在内存中分箱
+            if is_filtered_view:
+                level, cells = _grid_from_points(_view_points(map_df, load_bounds)[0], zoom_start)
+            else:
+                level, cells = query_density(zoom_start, load_bounds)
+            if not cells.empty:
+                _density_layer(cells, level).add_to(m)
+            st.sidebar.info(f"当前地图展示了 {len(cells)} 个密度网格 (边长约 {grid_cell_size(level) * 111:.2f} km)，"
+                            f"共 {int(cells['cnt'].sum())} 个轨迹点。")
+            if display_mode == "航线轨迹":
+                st.sidebar.info(f"放大到 {MAP_CONFIG['track_min_zoom']} 级及以上时显示航线轨迹。")
+        elif display_mode == "航线轨迹":
+            # 视野内的点按航线连成折线，按当前缩放级别抽稀折点；点数超过上限时先在库中均匀抽样
+            view_df, in_view = _view_points(map_df if is_filtered_view else None, load_bounds, max_points)
+            view_df = view_df[thin_points(view_df['GpsLatitude'], view_df['GpsLongitude'], max_points, load_bounds)]
+            tracks = _flight_tracks(view_df, zoom_start)
+            _track_layer(tracks).add_to(m)
+            st.sidebar.info(f"视野内共 {len(tracks)} 段航线轨迹，{sum(n for _, _, n in tracks)} 个轨迹点"
+                            f"抽稀为 {sum(len(c) for _, c, _ in tracks)} 个折点。")
+            if len(view_df) < in_view:
+                st.sidebar.info(f"视野内共 {in_view} 个轨迹点，按均匀抽取的 {len(view_df)} 个连线，放大地图可查看完整轨迹。")
+        else:
+            # 只取视野内的点，超过上限时按空间均匀抽稀
+            view_df, in_view = _view_points(map_df if is_filtered_view else None, load_bounds, max_points)
+            view_df = view_df[thin_points(view_df['GpsLatitude'], view_df['GpsLongitude'], max_points, load_bounds)]
 
-        for marker in markers:
-            marker.add_to(marker_cluster)
+            # 全部点作为一个紧凑数组发给浏览器，由 FastMarkerCluster 在前端逐行创建圆点
+            points_data = view_df[['GpsLatitude', 'GpsLongitude']].round(6)
+            points_data['filename'] = view_df['filename'].fillna("")
+            points_data['AbsoluteAltitude'] = view_df['AbsoluteAltitude'].round(1).astype(object).where(
+                view_df['AbsoluteAltitude'].notna(), None)
+            FastMarkerCluster(
+                points_data.values.tolist(),
+                callback=POINT_CALLBACK.replace('__RADIUS__', str(int(point_radius))),
+                name="聚合图层",
+                disable_clustering_at_zoom=16,
+                chunked_loading=True,  # 分批加入聚合，避免大数据量时页面卡死
+            ).add_to(m)
 
+            if len(view_df) < in_view:
+                st.sidebar.info(f"视野内共 {in_view} 个轨迹点，均匀抽取展示了 {len(view_df)} 个，放大地图可查看更多。")
+            else:
+                st.sidebar.info(f"当前地图展示了视野内的 {len(view_df)} 个轨迹点。")
 
         # 渲染地图
         # st_folium(m, width=None, height=620)
 
-        st.sidebar.info(f"当前地图展示了 {len(map_df)} 个轨迹点。")
-
         draw = Draw(
             export=False,
             position='topleft',
             draw_options={
                 'polyline': False,
-                'polygon': False,
-                'circle': False,
-                'marker': False,
+                'polygon': True,
+                'circle': True,
+                'marker': True,  # 标记点按侧边栏的检索半径当作圆
                 'circlemarker': False,
-                'rectangle': True  # 只开启矩形框选
+                'rectangle': True  # 矩形、多边形、圆形框选
             }
         )
         draw.add_to(m)
@@ -158,6 +365,16 @@ def render_map():
                 'is_submitted': True
             }
             st.rerun()
+
+        if output and output.get('zoom') is not None and output.get('center'):
+            new_bounds = _output_bounds(output)
+            st.session_state['map_view'] = {'zoom': output['zoom'], 'center': output['center'], 'bounds': new_bounds}
+            if display_mode != "原始点" and _view_key(output['zoom']) != _view_key(zoom_start):
+                st.rerun()
+            # 平移出已读取的范围后重新查询；原始点 / 航线轨迹缩放后还要按新的级别重新抽稀
+            if ((new_bounds and not bounds_contain(load_bounds, new_bounds))
+                    or (not show_density and output['zoom'] != zoom_start)):
+                st.rerun()
         
 
         snapshot = st.session_state['params_snapshot']
@@ -166,34 +383,23 @@ def render_map():
             st.divider()
             st.subheader("📊 筛选结果")
             
-            with st.spinner("正在计算 20,000+ 条数据的位置关系..."):
-                filtered_df = map_df.copy()
-
+            with st.spinner("正在查询选区内的数据..."):
                 drawings = snapshot['drawings']
                 if drawings:
-                    final_mask = pd.Series([False] * len(filtered_df), index=filtered_df.index)
-                    box_count = 0
-                    
-                    for shape in drawings:
-                        if shape['geometry']['type'] == 'Polygon':
-                            coords = shape['geometry']['coordinates'][0]
-                            lons = [p[0] for p in coords]
-                            lats = [p[1] for p in coords]
-                            
-                            mask = (
-                                (filtered_df['GpsLatitude'] >= min(lats)) & 
-                                (filtered_df['GpsLatitude'] <= max(lats)) & 
-                                (filtered_df['GpsLongitude'] >= min(lons)) & 
-                                (filtered_df['GpsLongitude'] <= max(lons))
-                            )
-                            final_mask = final_mask | mask
-                            box_count += 1
-                        else:
-                            st.info("地图上未绘制选区，显示符合其他条件的数据。")
-
-                    filtered_df = filtered_df[final_mask]
-                    st.success(f"共找到 {len(filtered_df)} 条数据")
-                    st.dataframe(filtered_df, use_container_width=True)
+                    rings, circles = parse_shapes(drawings, marker_radius)
+                    if not rings and not circles:
+                        st.info("地图上未绘制选区，显示符合其他条件的数据。")
+                    if is_filtered_view:
+                        # 同步过来的结果已在内存中：网格索引选出 id，再按 id 读取明细
+                        index, ids = _point_index(df, map_df)
+                        hits = [index.in_ring(ring) for ring in rings] + [index.in_circle(*c) for c in circles]
+                        selected = np.unique(np.concatenate(hits)) if hits else np.zeros(0, dtype=np.int64)
+                        detail_df = query_rows_by_ids(ids[selected], PROJECTIONS['map_detail'])
+                    else:
+                        # 全库选区在数据库中查询，覆盖全部数据，而不只是地图上显示的点
+                        detail_df = query_in_shapes(drawings, PROJECTIONS['map_detail'], marker_radius=marker_radius)
+                    st.success(f"共找到 {len(detail_df)} 条数据")
+                    st.dataframe(detail_df, use_container_width=True)
                 
                 else:
                     st.info("👈 请在左侧设置条件，并在地图上画框后，点击【执行筛选】按钮查看结果。")
@@ -42,6 +42,12 @@ def calculate_md5(file_input):
     except Exception as e:
         return None
 
+def folder_key(file_path):
+    """
+    文件所在目录的统一写法 (分隔符统一为 /)，与 file_dir_tags.full_path 一致
+    """
+    return os.path.dirname(os.path.normpath(file_path).replace('\\', '/'))
+
 def color_wash(val):    # 把颜色清洗为中文
     if pd.isna(val): return "无"
     s = str(val)
@@ -1,87 +1,620 @@
 import streamlit as st
 import pandas as pd
 import mysql.connector
+from mysql.connector import pooling
 import os
+import posixpath
+import re
 import time
+import threading
 import openpyxl
+from collections import Counter
+
+from config import DB_CONFIG, POOL_CONFIG, COLUMN_MAPPING, INGEST_CONFIG, MAP_CONFIG
+from utils.common import format_size, calculate_md5, folder_key
+from utils.geo import grid_cells
+from utils import sqlite_backend
+
+# ---------------- 存储后端 ----------------
+_BACKEND_KEYS = ('backend', 'sqlite_path')
+
+def is_sqlite():
+    return DB_CONFIG.get('backend', 'mysql') == 'sqlite'
+
+def mysql_params():
+    """
+    DB_CONFIG 中交给 mysql.connector 的连接参数 (去掉后端选择相关的键)
+    """
+    return {k: v for k, v in DB_CONFIG.items() if k not in _BACKEND_KEYS}
+
+# ---------------- 连接池 ----------------
+_pool_stats = {
+    'checkouts': 0,         # 成功取出连接的次数
+    'waits': 0,             # 池已用尽、需要排队的次数
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0,
+    'timeouts': 0,          # 等待超时的次数
+    'reconnects': 0,        # 健康检查发现断线后重连的次数
+}
+_pool_stats_lock = threading.Lock()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_pool():
+    """
+    进程内共享的连接池，所有页面和后台线程共用
+    """
+    return pooling.MySQLConnectionPool(
+        pool_name=POOL_CONFIG['pool_name'],
+        pool_size=min(int(POOL_CONFIG['pool_size']), pooling.CNX_POOL_MAXSIZE),
+        pool_reset_session=True,
+        **mysql_params()
+    )
 
-from config import DB_CONFIG, COLUMN_MAPPING
-from utils.common import format_size
 
 def get_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    """
+    从连接池取出一个连接；用完调用 close() 即归还到池中
+    SQLite 后端则返回当前线程的本地连接，close() 同样只是“归还”
+    """
+    if is_sqlite():
+        conn = sqlite_backend.get_thread_connection(DB_CONFIG['sqlite_path'], timeout=POOL_CONFIG['timeout'])
+        with _pool_stats_lock:
+            _pool_stats['checkouts'] += 1
+        return conn
 
-def save_to_db(data_list):  # 储存到数据库
-    if not data_list: return 0
+    pool = _get_pool()
+    start = time.perf_counter()
+    deadline = start + POOL_CONFIG['timeout']
+    waited = False
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            # 池中连接全部借出，等待其他操作归还
+            waited = True
+            if time.perf_counter() >= deadline:
+                with _pool_stats_lock:
+                    _pool_stats['timeouts'] += 1
+                raise
+            time.sleep(POOL_CONFIG['retry_interval'])
+    wait_time = time.perf_counter() - start
 
+    reconnected = False
+    if POOL_CONFIG['health_check']:
+        try:
+            conn.ping(reconnect=False)
+        except mysql.connector.Error:
+            # 连接被服务器断开 (wait_timeout 等)，原地重连
+            conn.reconnect(attempts=2, delay=0)
+            reconnected = True
+
+    with _pool_stats_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['wait_time_total'] += wait_time
+        _pool_stats['wait_time_max'] = max(_pool_stats['wait_time_max'], wait_time)
+        if waited:
+            _pool_stats['waits'] += 1
+        if reconnected:
+            _pool_stats['reconnects'] += 1
+    return conn
+
+
+def get_pool_stats():
+    """
+    连接池使用统计，用于评估 pool_size 是否够用
+    """
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats['backend'] = DB_CONFIG.get('backend', 'mysql')
+    stats['pool_size'] = min(int(POOL_CONFIG['pool_size']), pooling.CNX_POOL_MAXSIZE)
+    stats['avg_wait_ms'] = stats['wait_time_total'] / stats['checkouts'] * 1000 if stats['checkouts'] else 0.0
+    stats['max_wait_ms'] = stats['wait_time_max'] * 1000
+    return stats
+
+# ---------------- 数据版本 ----------------
+def _bump_version(cursor, *scopes):
+    """
+    数据版本号 +1，与写操作在同一事务中提交；页面缓存据此判断是否需要重新读取
+    photos: 照片记录增删改 / marks: 备注标记
+    """
+    if is_sqlite():
+        sql = ("INSERT INTO data_version (name, version) VALUES (%s, 1) "
+               "ON CONFLICT (name) DO UPDATE SET version = version + 1")
+    else:
+        sql = ("INSERT INTO data_version (name, version) VALUES (%s, 1) "
+               "ON DUPLICATE KEY UPDATE version = version + 1")
+    for scope in scopes:
+        try:
+            cursor.execute(sql, (scope,))
+        except Exception as e:
+            # 旧库没有 data_version 表时不影响写入，只是缓存会退化为每次重新读取
+            print(f"数据版本更新失败: {e}")
+
+def get_data_version():
+    """
+    读取当前数据版本 {'photos': (版本号, MAX(id)), 'marks': (版本号, photos 版本)}
+    MAX(id) 走主键，用来兜住迁移脚本等绕过版本号的写入；读取失败返回 None
+    """
     conn = None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_connection()
         cursor = conn.cursor()
+        cursor.execute("SELECT name, version FROM data_version")
+        versions = dict(cursor.fetchall())
+        cursor.execute("SELECT MAX(id) FROM drone_photos")
+        max_id = cursor.fetchone()[0]
+        photos = (versions.get('photos', 0), max_id)
+        return {'photos': photos, 'marks': (versions.get('marks', 0), photos)}
+    except Exception as e:
+        print(f"读取数据版本失败: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+# ---------------- 筛选项汇总 (photo_facets) ----------------
+# (facet 名, drone_photos 列)；facet 'all' 保存全表的条数与拍摄时间范围
+FACET_COLUMNS = [('folder', 'FolderName'), ('type', 'FileType'), ('model', 'DroneModel'), ('version', 'Version')]
+DIR_FACET_COLUMNS = [('dir1', 'dir_level_1'), ('dir2', 'dir_level_2'), ('dir3', 'dir_level_3')]
+
+# 目录统计中区分照片 / 视频的文件类型
+PHOTO_TYPES = ('.jpg', '.jpeg')
+VIDEO_TYPES = ('.mp4', '.mov')
+RTK_FIXED = 50  # RtkFlag 固定解
+
+def _merge_sql(keys, sums=(), mins=(), maxs=()):
+    """
+    汇总表的累加写法：主键冲突时 sums 相加，mins / maxs 取两者中更小 / 更大的值
+    """
+    if is_sqlite():
+        new = lambda c: f"excluded.{c}"
+        least, greatest = "MIN", "MAX"
+        head = f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET "
+    else:
+        new = lambda c: f"VALUES({c})"
+        least, greatest = "LEAST", "GREATEST"
+        head = "ON DUPLICATE KEY UPDATE "
+    sets = [f"{c} = {c} + {new(c)}" for c in sums]
+    sets += [f"{c} = COALESCE({least}({c}, {new(c)}), {c}, {new(c)})" for c in mins]
+    sets += [f"{c} = COALESCE({greatest}({c}, {new(c)}), {c}, {new(c)})" for c in maxs]
+    return head + ", ".join(sets)
 
-        incoming_hashes = [item.get('FileHash') for item in data_list if item.get('FileHash')]
+def _facet_select_sql(facet, column, where):
+    # 别名与 photo_facets 的列名错开，避免 ON DUPLICATE KEY UPDATE 中出现歧义
+    fields = "COUNT(*) AS d_cnt, MIN(capture_time) AS d_min, MAX(capture_time) AS d_max"
+    if column is None:
+        return (f"SELECT '{facet}' AS d_facet, '' AS d_value, {fields} "
+                f"FROM drone_photos WHERE {where} HAVING COUNT(*) > 0")
+    return (f"SELECT '{facet}' AS d_facet, `{column}` AS d_value, {fields} "
+            f"FROM drone_photos WHERE {where} AND `{column}` IS NOT NULL GROUP BY `{column}`")
 
-        existing_hashes = set()
+def _folder_stats_select_sql(where):
+    def count_in(types):
+        return f"SUM(CASE WHEN FileType IN ({', '.join(repr(t) for t in types)}) THEN 1 ELSE 0 END)"
+    return ("SELECT folder_id AS d_folder, COUNT(*) AS d_files, "
+            f"{count_in(PHOTO_TYPES)} AS d_photos, {count_in(VIDEO_TYPES)} AS d_videos, "
+            "COALESCE(SUM(FileSize), 0) AS d_bytes, MIN(capture_time) AS d_min, MAX(capture_time) AS d_max, "
+            f"SUM(CASE WHEN RtkFlag = {RTK_FIXED} THEN 1 ELSE 0 END) AS d_rtk "
+            f"FROM drone_photos WHERE {where} AND folder_id IS NOT NULL GROUP BY folder_id")
 
-        if incoming_hashes:
-            placeholders_check = ', '.join(['%s'] * len(incoming_hashes))
-            sql_check = f"SELECT FileHash FROM drone_photos WHERE FileHash IN ({placeholders_check})"
+def _folder_models_select_sql(where):
+    return ("SELECT folder_id AS d_folder, DroneModel AS d_model, COUNT(*) AS d_cnt FROM drone_photos "
+            f"WHERE {where} AND folder_id IS NOT NULL AND DroneModel IS NOT NULL GROUP BY folder_id, DroneModel")
 
-            cursor.execute(sql_check, tuple(incoming_hashes))
+_FOLDER_STATS_COLUMNS = "folder_id, file_cnt, photo_cnt, video_cnt, total_bytes, min_time, max_time, rtk_fixed_cnt"
 
-            result = cursor.fetchall()
-            for row in result:
-                existing_hashes.add(row[0])
+# 密度网格：每个缩放层级一套经纬度格子，地图缩小时直接画格子，不再逐点读取
+_DENSITY_COLUMNS = ['level', 'cx', 'cy', 'cnt', 'alt_sum', 'alt_cnt', 'rtk_fixed_cnt']
+_DENSITY_POINT_SQL = "SELECT GpsLatitude, GpsLongitude, AbsoluteAltitude, RtkFlag FROM drone_photos WHERE "
 
-        final_data_list = [
-            item for item in data_list
-            if item.get('FileHash') not in existing_hashes
-        ]
+def _density_cells(rows):
+    """
+    把 (纬度, 经度, 高度, RtkFlag) 行按 MAP_CONFIG['grid_zooms'] 各层分箱
+    """
+    if not rows: return []
+    arr = pd.DataFrame(rows, columns=['lat', 'lon', 'alt', 'rtk']).apply(pd.to_numeric, errors='coerce')
+    return grid_cells(arr['lat'], arr['lon'], arr['alt'], (arr['rtk'] == RTK_FIXED).to_numpy(),
+                      MAP_CONFIG['grid_zooms'])
 
-        # 如果过滤完发现全是重复的，直接返回
-        if not final_data_list:
-            # print("本批次所有数据均为重复，跳过。")
-            return 0
+def _merge_density(cursor, cells):
+    if not cells: return
+    merge = _merge_sql(['level', 'cx', 'cy'], sums=['cnt', 'alt_sum', 'alt_cnt', 'rtk_fixed_cnt'])
+    cursor.executemany(f"INSERT INTO density_grid ({', '.join(_DENSITY_COLUMNS)}) "
+                       f"VALUES ({', '.join(['%s'] * len(_DENSITY_COLUMNS))}) {merge}", cells)
 
-        keys = list(final_data_list[0].keys())
-        cols = ", ".join(f"`{k}`" for k in keys)
-        placeholders = ", ".join(["%s"] * len(keys))
+def _apply_insert_deltas(cursor, where, params):
+    """
+    入库后的增量维护入口：只聚合本批次新写入的记录 (where 圈定)，累加到各汇总表
+    """
+    # 包一层派生表，MySQL 才允许在 ON DUPLICATE KEY UPDATE 中引用 GROUP BY 的结果
+    merge = _merge_sql(['facet', 'value'], sums=['cnt'], mins=['min_time'], maxs=['max_time'])
+    for facet, column in FACET_COLUMNS + [('all', None)]:
+        cursor.execute(
+            "INSERT INTO photo_facets (facet, value, cnt, min_time, max_time) "
+            f"SELECT * FROM ({_facet_select_sql(facet, column, where)}) AS d WHERE 1 = 1 {merge}",
+            params
+        )
+
+    merge = _merge_sql(['folder_id'], sums=['file_cnt', 'photo_cnt', 'video_cnt', 'total_bytes', 'rtk_fixed_cnt'],
+                       mins=['min_time'], maxs=['max_time'])
+    cursor.execute(f"INSERT INTO folder_stats ({_FOLDER_STATS_COLUMNS}) "
+                   f"SELECT * FROM ({_folder_stats_select_sql(where)}) AS d WHERE 1 = 1 {merge}", params)
+    merge = _merge_sql(['folder_id', 'model'], sums=['cnt'])
+    cursor.execute("INSERT INTO folder_models (folder_id, model, cnt) "
+                   f"SELECT * FROM ({_folder_models_select_sql(where)}) AS d WHERE 1 = 1 {merge}", params)
+
+    # 网格编号由 NumPy 计算：只取本批次的坐标，分箱后累加
+    cursor.execute(_DENSITY_POINT_SQL + where, params)
+    _merge_density(cursor, _density_cells(cursor.fetchall()))
+
+def _delete_photos(cursor, ids):
+    """
+    删除照片记录并同步扣减各汇总表；被删记录恰好落在时间边界上时，重新计算该项的时间范围
+    """
+    if not ids: return 0
+    placeholders = ', '.join(['%s'] * len(ids))
+    where = f"id IN ({placeholders})"
+    deltas = []
+    for facet, column in FACET_COLUMNS + [('all', None)]:
+        cursor.execute(_facet_select_sql(facet, column, where), tuple(ids))
+        deltas += cursor.fetchall()
+    cursor.execute(_folder_stats_select_sql(where), tuple(ids))
+    folder_deltas = cursor.fetchall()
+    cursor.execute(_folder_models_select_sql(where), tuple(ids))
+    model_deltas = cursor.fetchall()
+    cursor.execute(_DENSITY_POINT_SQL + where, tuple(ids))
+    density_deltas = _density_cells(cursor.fetchall())
 
-        sql = f"INSERT INTO drone_photos ({cols}) VALUES ({placeholders})"
+    cursor.execute(f"DELETE FROM drone_photos WHERE {where}", tuple(ids))
+    deleted = cursor.rowcount
+
+    columns = dict(FACET_COLUMNS)
+    for facet, value, cnt, t_min, t_max in deltas:
+        cursor.execute("UPDATE photo_facets SET cnt = cnt - %s WHERE facet = %s AND value = %s", (cnt, facet, value))
+        if t_min is None: continue
+        cond = f"`{columns[facet]}` = %s" if facet in columns else "1 = 1"
+        params = (value,) if facet in columns else ()
+        cursor.execute(
+            f"UPDATE photo_facets SET "
+            f"min_time = (SELECT MIN(capture_time) FROM drone_photos WHERE {cond}), "
+            f"max_time = (SELECT MAX(capture_time) FROM drone_photos WHERE {cond}) "
+            f"WHERE facet = %s AND value = %s AND cnt > 0 AND (min_time >= %s OR max_time <= %s)",
+            params + params + (facet, value, t_min, t_max)
+        )
+    cursor.execute("DELETE FROM photo_facets WHERE cnt <= 0 AND facet NOT LIKE 'dir%'")
+
+    for folder_id, files, photos, videos, size, t_min, t_max, rtk in folder_deltas:
+        cursor.execute(
+            "UPDATE folder_stats SET file_cnt = file_cnt - %s, photo_cnt = photo_cnt - %s, video_cnt = video_cnt - %s, "
+            "total_bytes = total_bytes - %s, rtk_fixed_cnt = rtk_fixed_cnt - %s WHERE folder_id = %s",
+            (files, photos, videos, size, rtk, folder_id)
+        )
+        if t_min is None: continue
+        cursor.execute(
+            "UPDATE folder_stats SET "
+            "min_time = (SELECT MIN(capture_time) FROM drone_photos WHERE folder_id = %s), "
+            "max_time = (SELECT MAX(capture_time) FROM drone_photos WHERE folder_id = %s) "
+            "WHERE folder_id = %s AND file_cnt > 0 AND (min_time >= %s OR max_time <= %s)",
+            (folder_id, folder_id, folder_id, t_min, t_max)
+        )
+    cursor.execute("DELETE FROM folder_stats WHERE file_cnt <= 0")
+    cursor.executemany("UPDATE folder_models SET cnt = cnt - %s WHERE folder_id = %s AND model = %s",
+                       [(cnt, folder_id, model) for folder_id, model, cnt in model_deltas])
+    cursor.execute("DELETE FROM folder_models WHERE cnt <= 0")
+    cursor.executemany(
+        "UPDATE density_grid SET cnt = cnt - %s, alt_sum = alt_sum - %s, alt_cnt = alt_cnt - %s, "
+        "rtk_fixed_cnt = rtk_fixed_cnt - %s WHERE level = %s AND cx = %s AND cy = %s",
+        [(cnt, alt_sum, alt_cnt, rtk, level, cx, cy) for level, cx, cy, cnt, alt_sum, alt_cnt, rtk in density_deltas]
+    )
+    cursor.execute("DELETE FROM density_grid WHERE cnt <= 0")
+    return deleted
+
+def _rebuild_dir_facets(cursor):
+    """
+    目录层级选项 (file_dir_tags 只有文件夹级别的数据，直接整体重算)
+    """
+    cursor.execute("DELETE FROM photo_facets WHERE facet IN ('dir1', 'dir2', 'dir3')")
+    for facet, column in DIR_FACET_COLUMNS:
+        cursor.execute(
+            f"INSERT INTO photo_facets (facet, value, cnt) SELECT '{facet}', `{column}`, COUNT(*) "
+            f"FROM file_dir_tags WHERE `{column}` IS NOT NULL AND `{column}` <> '' GROUP BY `{column}`"
+        )
+
+def rebuild_facets(cursor):
+    """
+    按全表重新生成 photo_facets
+    """
+    cursor.execute("DELETE FROM photo_facets")
+    for facet, column in FACET_COLUMNS + [('all', None)]:
+        cursor.execute("INSERT INTO photo_facets (facet, value, cnt, min_time, max_time) "
+                       + _facet_select_sql(facet, column, "1 = 1"))
+    _rebuild_dir_facets(cursor)
+
+def rebuild_folder_stats(cursor):
+    """
+    按全表重新生成目录统计 (folder_stats / folder_models)
+    """
+    cursor.execute("DELETE FROM folder_stats")
+    cursor.execute(f"INSERT INTO folder_stats ({_FOLDER_STATS_COLUMNS}) " + _folder_stats_select_sql("1 = 1"))
+    cursor.execute("DELETE FROM folder_models")
+    cursor.execute("INSERT INTO folder_models (folder_id, model, cnt) " + _folder_models_select_sql("1 = 1"))
+
+def rebuild_density_grid(cursor, chunk_size=50000):
+    """
+    按全表重新生成密度网格：按 id 分段读取坐标，每段分箱后合并，最后一次写入
+    """
+    cursor.execute("DELETE FROM density_grid")
+    frames = []
+    last_id = 0
+    while True:
+        cursor.execute(f"SELECT id, GpsLatitude, GpsLongitude, AbsoluteAltitude, RtkFlag FROM drone_photos "
+                       f"WHERE id > %s ORDER BY id LIMIT {int(chunk_size)}", (last_id,))
+        rows = cursor.fetchall()
+        if not rows: break
+        last_id = rows[-1][0]
+        frames.append(pd.DataFrame(_density_cells([row[1:] for row in rows]), columns=_DENSITY_COLUMNS))
+    if not frames: return
+    df = pd.concat(frames).groupby(['level', 'cx', 'cy'], as_index=False).sum()
+    cursor.executemany(f"INSERT INTO density_grid ({', '.join(_DENSITY_COLUMNS)}) "
+                       f"VALUES ({', '.join(['%s'] * len(_DENSITY_COLUMNS))})",
+                       [tuple(row) for row in df.astype(object).itertuples(index=False)])
 
-        # 构造 values 列表
-        values = [[item.get(k) for k in keys] for item in final_data_list]
+def rebuild_summaries(cursor=None):
+    """
+    重新生成全部汇总表 (旧库升级、手工改库或迁移数据之后执行一次)
+    """
+    if cursor is not None:
+        rebuild_facets(cursor)
+        rebuild_folder_stats(cursor)
+        rebuild_density_grid(cursor)
+        return
 
-        cursor.executemany(sql, values)
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        rebuild_summaries(cursor)
+        _bump_version(cursor, 'photos')
         conn.commit()
+        return True
+    except Exception as e:
+        st.error(f"重建汇总失败: {e}")
+        return False
+    finally:
+        if conn: conn.close()
+
+def _file_md5(path):
+    return calculate_md5(path) if path and os.path.exists(path) else None
+
+def _resolve_quick_hash_collisions(cursor, data_list):
+    """
+    分级指纹去重：本批次每条记录的 QuickHash 都与库中已有记录比对
+    - 本条没有完整 MD5 (分级模式)：与库中或本批次内的记录碰撞时计算完整 MD5
+    - 碰撞到的库中记录也没有完整 MD5 (分级模式入库)：给它补上 MD5，路径相同时直接沿用本条的 MD5，
+      之后完整模式再次入库同一批文件时也能由 idx_filehash 去重
+    旧版 (完整 MD5 模式) 入库的记录没有 QuickHash，同一路径下已有这类记录时也计算完整 MD5，交给 idx_filehash 去重
+    完整 MD5 全部算完后才写库，读 NAS 期间不持有行锁
+    """
+    items = [item for item in data_list if item.get('QuickHash')]
+    if not items: return 0
+
+    quick_hashes = list({item['QuickHash'] for item in items})
+    placeholders = ', '.join(['%s'] * len(quick_hashes))
+    cursor.execute(
+        f"SELECT id, QuickHash, FileHash, FullPath FROM drone_photos WHERE QuickHash IN ({placeholders})",
+        tuple(quick_hashes)
+    )
+    collided = set()
+    backfill = []
+    for row_id, quick_hash, full_hash, path in cursor.fetchall():
+        collided.add(quick_hash)
+        if not full_hash:
+            backfill.append((row_id, path))
+
+    # 同目录下没有 QuickHash 的旧记录 (按 idx_folder_id 查)，路径相同即视为可能重复
+    pending = [item for item in items if not item.get('FileHash')]
+    folder_ids = list({item['folder_id'] for item in pending if item.get('folder_id') is not None})
+    legacy_paths = set()
+    if folder_ids:
+        cursor.execute(
+            f"SELECT FullPath FROM drone_photos WHERE folder_id IN ({', '.join(['%s'] * len(folder_ids))}) "
+            "AND QuickHash IS NULL", tuple(folder_ids)
+        )
+        legacy_paths = {row[0] for row in cursor.fetchall()}
+
+    batch_counts = Counter(item['QuickHash'] for item in items)
+    for item in pending:
+        if (item['QuickHash'] in collided or batch_counts[item['QuickHash']] > 1
+                or item.get('FullPath') in legacy_paths):
+            item['FileHash'] = _file_md5(item.get('FullPath'))
+
+    # 同一文件不重复读取：库中记录与本批次某条路径相同时，直接用本条已有的 MD5
+    known = {item['FullPath']: item['FileHash'] for item in items if item.get('FullPath') and item.get('FileHash')}
+    backfill = [(full_hash, row_id) for full_hash, row_id in
+                ((known.get(path) or _file_md5(path), row_id) for row_id, path in backfill) if full_hash]
+
+    # 库中记录也还没有完整 MD5，顺便补上 (IGNORE：若库中已存在同哈希记录则保持原样，交给补全流程处理)
+    updated = 0
+    for full_hash, row_id in backfill:
+        cursor.execute("UPDATE IGNORE drone_photos SET FileHash = %s WHERE id = %s", (full_hash, row_id))
+        updated += max(cursor.rowcount, 0)
+    return updated
+
+def _insert_rows_sql(keys, row_count):
+    """
+    多行 INSERT，遇到 idx_filehash 重复时 id = id 原样保留 (影响行数为 0)，
+    因此 rowcount 恰好等于新增行数；与 INSERT IGNORE 不同，其他错误仍会正常报出
+    SQLite 使用 ON CONFLICT DO NOTHING，语义相同
+    """
+    cols = ", ".join(f"`{k}`" for k in keys)
+    row_placeholder = "(" + ", ".join(["%s"] * len(keys)) + ")"
+    conflict = " ON CONFLICT DO NOTHING" if is_sqlite() else " ON DUPLICATE KEY UPDATE id = id"
+    return (f"INSERT INTO drone_photos ({cols}) VALUES "
+            + ", ".join([row_placeholder] * row_count)
+            + conflict)
+
+def _claim_new_rows(cursor, batch, first_id, inserted):
+    """
+    MySQL：找出本批次新写入的记录，返回 (where, params)
+    innodb_autoinc_lock_mode=2 (MySQL 8 默认) 时，并发会话的自增 id 可能穿插在本批次之间，
+    不能按 [首个新 id, 首个新 id + 行数 - 1] 圈定；本批次的新 id 都不小于 lastrowid，再按本批次的路径 / 哈希认领
+    """
+    paths = list({item['FullPath'] for item in batch if item.get('FullPath')})
+    hashes = list({item['FileHash'] for item in batch if item.get('FileHash')})
+    conds = []
+    if paths: conds.append(f"FullPath IN ({', '.join(['%s'] * len(paths))})")
+    if hashes: conds.append(f"FileHash IN ({', '.join(['%s'] * len(hashes))})")
+    if not conds:
+        return "1 = 0", ()
+    cursor.execute(f"SELECT id FROM drone_photos WHERE id >= %s AND ({' OR '.join(conds)}) "
+                   f"ORDER BY id LIMIT {int(inserted)}", (first_id, *paths, *hashes))
+    ids = [row[0] for row in cursor.fetchall()]
+    return f"id IN ({', '.join(['%s'] * len(ids))})" if ids else "1 = 0", tuple(ids)
+
+def bulk_save_to_db(data_list, batch_size=None, raise_on_error=False):
+    """
+    批量入库：每批只发一条多行 INSERT，由 idx_filehash 唯一键去重，不再预先 SELECT
+    返回每批的统计 [{'rows', 'inserted', 'skipped'}]
+    """
+    if not data_list: return []
+    batch_size = max(1, int(batch_size or INGEST_CONFIG['batch_size']))
+
+    conn = None
+    reports = []
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        _backfill_legacy_folders(conn)
+        # 所在目录登记到 folders (单独提交)，照片只存整数 folder_id
+        folder_ids = _ensure_folders(conn, {folder_key(item['FullPath']) for item in data_list if item.get('FullPath')})
+        for item in data_list:
+            if 'folder_id' not in item:
+                item['folder_id'] = folder_ids.get(folder_key(item['FullPath'])) if item.get('FullPath') else None
 
-        return cursor.rowcount
+        changed = _resolve_quick_hash_collisions(cursor, data_list)
+
+        keys = list(data_list[0].keys())
+        for i in range(0, len(data_list), batch_size):
+            batch = data_list[i:i + batch_size]
+            if is_sqlite():
+                # 先拿写锁，MAX(id) 之后到提交之前只有本批次在写，新记录即 id 更大的那些
+                if not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM drone_photos")
+                new_rows = ("id >= %s", (cursor.fetchone()[0] + 1,))
+                # 本地库没有网络往返，单行语句 executemany 复用同一条预编译语句，也不受变量个数上限限制
+                cursor.executemany(_insert_rows_sql(keys, 1), [[item.get(k) for k in keys] for item in batch])
+                inserted = max(cursor.rowcount, 0)
+            else:
+                values = [item.get(k) for item in batch for k in keys]
+                cursor.execute(_insert_rows_sql(keys, len(batch)), values)
+                inserted = max(cursor.rowcount, 0)
+                new_rows = _claim_new_rows(cursor, batch, cursor.lastrowid, inserted) if inserted else None
+            if inserted:
+                _apply_insert_deltas(cursor, *new_rows)
+            if inserted or changed:
+                _bump_version(cursor, 'photos')
+                changed = 0
+            conn.commit()
+            reports.append({'rows': len(batch), 'inserted': inserted, 'skipped': len(batch) - inserted})
+        return reports
 
     except Exception as e:
+        if raise_on_error:
+            raise
         st.error(f"入库失败: {e}")
-        return 0
+        return reports
     finally:
-        if conn and conn.is_connected():
-            cursor.close()
+        # 断线的连接也要 close()，否则不会归还到连接池
+        if conn:
             conn.close()
 
+def save_to_db(data_list, raise_on_error=False):  # 储存到数据库，返回新增条数
+    reports = bulk_save_to_db(data_list, batch_size=len(data_list) or 1, raise_on_error=raise_on_error)
+    return sum(r['inserted'] for r in reports)
+
 def clear_all_data():
+    conn = None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("TRUNCATE TABLE drone_photos")
+        # 清单必须一起清空，否则增量扫描会把已删除的文件当成“未变化”而跳过
+        cursor.execute("TRUNCATE TABLE file_manifest")
+        cursor.execute("DELETE FROM photo_facets WHERE facet NOT IN ('dir1', 'dir2', 'dir3')")
+        cursor.execute("DELETE FROM folder_stats")
+        cursor.execute("DELETE FROM folder_models")
+        cursor.execute("DELETE FROM density_grid")
+        _bump_version(cursor, 'photos', 'marks')
         conn.commit()
-        conn.close()
         return True
     except Exception as e:
         st.error(f"清空失败: {e}")
         return False
+    finally:
+        if conn: conn.close()
+
+_COLUMN_RE = re.compile(r'^\w+$')
 
-def load_data_from_db():
-    conn = mysql.connector.connect(**DB_CONFIG)
-    query = "SELECT * FROM drone_photos ORDER BY capture_time DESC"
-    df = pd.read_sql(query, conn)
-    conn.close()
+def quote_col(name):
+    """
+    列名只允许字母数字下划线，拼进 SQL 前统一校验
+    """
+    if not _COLUMN_RE.match(name):
+        raise ValueError(f"非法列名: {name}")
+    return f"`{name}`"
+
+def _read_photos(columns=None):
+    conn = get_connection()
+    try:
+        select_sql = ", ".join(quote_col(c) for c in columns) if columns else "*"
+        query = f"SELECT {select_sql} FROM drone_photos ORDER BY capture_time DESC"
+        df = pd.read_sql(query, conn)
+    finally:
+        conn.close()
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _load_photos_cached(photos_version, columns):
+    # 每种列组合 (页面投影) 单独缓存
+    return _read_photos(columns)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_marks_cached(marks_version):
+    """
+    只读 id 和备注两列，备注修改后无需重新拉取整张表
+    """
+    conn = get_connection()
+    try:
+        sql = "SELECT id, mark_note FROM drone_photos WHERE mark_note IS NOT NULL AND mark_note <> ''"
+        df = pd.read_sql(sql, conn)
+    finally:
+        conn.close()
+    return df.set_index('id')['mark_note']
+
+def load_data_from_db(columns=None):
+    """
+    读取照片记录，columns 为页面需要的列 (见 config.PROJECTIONS)，None 表示全部列
+    数据版本不变时直接使用内存中的缓存；只有备注变化时仅重新读取备注并覆盖到缓存的结果上
+    """
+    columns = tuple(columns) if columns else None
+    version = get_data_version()
+    if version is None:
+        return _read_photos(columns)
+
+    with_notes = columns is None or 'mark_note' in columns
+    if with_notes and columns is not None and 'id' not in columns:
+        # 覆盖备注需要按 id 对齐
+        df = _load_photos_cached(version['photos'], columns + ('id',))
+    else:
+        df = _load_photos_cached(version['photos'], columns)
+    if with_notes:
+        notes = df['id'].map(_load_marks_cached(version['marks']))
+        df['mark_note'] = notes.astype(object).where(notes.notna(), None)
+        if columns is not None and 'id' not in columns:
+            df = df.drop(columns='id')
     return df
 
 def execute_raw_sql(sql_query):  # 执行原始 SQL 语句并返回 DataFrame
@@ -96,7 +629,7 @@ def execute_raw_sql(sql_query):  # 执行原始 SQL 语句并返回 DataFrame
 
     conn = None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_connection()
         # 使用 pandas 直接读取，它能自动处理列名和数据类型
         df_result = pd.read_sql(sql_query, conn)
         if 'FileSize' in df_result.columns:
@@ -109,109 +642,414 @@ def execute_raw_sql(sql_query):  # 执行原始 SQL 语句并返回 DataFrame
     finally:
         if conn: conn.close()
 
-def sync_dir_tags(file_path):
+def _dir_tag_row(file_path):
     """
-    解析文件路径，提取目录，存入 file_dir_tags 表
+    解析文件路径，返回所在目录的 (folder_name, full_path, dir_level_1, dir_level_2, dir_level_3)
     """
-    if not file_path: return
-    
+    if not file_path: return None
+
     norm_path = os.path.normpath(file_path).replace('\\', '/')
-    folder_path = os.path.dirname(norm_path)
-    #print(f"-----------------{folder_path}-------------------")
+    folder_path = folder_key(file_path)
 
     parts = norm_path.split('/')
-    
-    dir_parts = parts[:-1] 
-    if not dir_parts: return
-    
 
-    l1 = dir_parts[1] if len(dir_parts) >= 1 else ""
-    l2 = dir_parts[2] if len(dir_parts) >= 2 else ""
-    l3 = dir_parts[3] if len(dir_parts) >= 3 else ""
+    dir_parts = parts[:-1]
+    if not dir_parts: return None
+
+    # dir_parts[0] 是盘符 (或 / 开头时的空串)
+    l1 = dir_parts[1] if len(dir_parts) > 1 else ""
+    l2 = dir_parts[2] if len(dir_parts) > 2 else ""
+    l3 = dir_parts[3] if len(dir_parts) > 3 else ""
     folder_name = dir_parts[-1]
+    return (folder_name, folder_path, l1, l2, l3)
 
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+# ---------------- 目录表 (folders) ----------------
+# 进程内目录编号缓存 {目录: folders.id}，只在提交成功后写入
+_folder_ids = {}
+_folder_ids_lock = threading.Lock()
+
+def _folder_chain(path):
+    """
+    目录自身及其各级上级目录，由深到浅
+    """
+    chain = []
+    while path:
+        chain.append(path)
+        parent = posixpath.dirname(path)
+        if parent == path: break
+        path = parent
+    return chain
+
+def _ensure_folders(conn, paths, chunk_size=500):
+    """
+    确保目录及其各级上级目录都已登记到 folders 并提交，返回 {目录: folder_id}
+    """
+    paths = {p for p in paths if p}
+    with _folder_ids_lock:
+        missing = []
+        for path in paths:
+            for node in _folder_chain(path):
+                # 上级目录总是和下级一起登记，缓存里有就不用再往上找
+                if node in _folder_ids or node in missing: break
+                missing.append(node)
+
+        if missing:
+            cursor = conn.cursor()
+            found = {}
+            for i in range(0, len(missing), chunk_size):
+                chunk = missing[i:i + chunk_size]
+                cursor.execute(f"SELECT path, id FROM folders WHERE path IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                found.update(cursor.fetchall())
+
+            new_paths = [p for p in missing if p not in found]
+            if new_paths:
+                cursor.executemany("INSERT IGNORE INTO folders (path, name, depth) VALUES (%s, %s, %s)",
+                                   [(p, posixpath.basename(p) or p, len(_folder_chain(p)) - 1) for p in new_paths])
+                for i in range(0, len(new_paths), chunk_size):
+                    chunk = new_paths[i:i + chunk_size]
+                    cursor.execute(f"SELECT path, id FROM folders WHERE path IN ({', '.join(['%s'] * len(chunk))})",
+                                   chunk)
+                    found.update(cursor.fetchall())
+
+                links = []
+                for p in new_paths:
+                    parent = _folder_chain(p)[1:2]
+                    if parent:
+                        links.append((found.get(parent[0]) or _folder_ids.get(parent[0]), found[p]))
+                cursor.executemany("UPDATE folders SET parent_id = %s WHERE id = %s", links)
+            conn.commit()
+            _folder_ids.update(found)
+        return {p: _folder_ids[p] for p in paths}
+
+def backfill_folders(conn=None, chunk_size=5000):
+    """
+    旧数据补齐 folder_id：按 FullPath 登记目录并回填 drone_photos、file_dir_tags，返回回填的照片数
+    """
+    if conn is not None:
         cursor = conn.cursor()
-        
-        # 插入或忽略 (如果已存在则不覆盖标记状态)
-        sql = """
-        INSERT IGNORE INTO file_dir_tags 
-        (folder_name, full_path, dir_level_1, dir_level_2, dir_level_3) 
-        VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(sql, (folder_name, folder_path, l1, l2, l3))
+        total, last_id = 0, 0
+        while True:
+            cursor.execute("SELECT id, FullPath FROM drone_photos WHERE id > %s AND folder_id IS NULL "
+                           "AND FullPath IS NOT NULL ORDER BY id LIMIT %s", (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows: break
+            last_id = rows[-1][0]
+            ids = _ensure_folders(conn, {folder_key(p) for _, p in rows})
+            updates = [(ids[folder_key(p)], row_id) for row_id, p in rows if folder_key(p) in ids]
+            cursor.executemany("UPDATE drone_photos SET folder_id = %s WHERE id = %s", updates)
+            conn.commit()
+            total += len(updates)
+
+        cursor.execute("SELECT id, full_path FROM file_dir_tags WHERE folder_id IS NULL")
+        rows = cursor.fetchall()
+        ids = _ensure_folders(conn, {p for _, p in rows})
+        cursor.executemany("UPDATE file_dir_tags SET folder_id = %s WHERE id = %s",
+                           [(ids[p], row_id) for row_id, p in rows if p in ids])
+        _bump_version(cursor, 'photos')
         conn.commit()
+        return total
+
+    try:
+        conn = get_connection()
+        return backfill_folders(conn, chunk_size)
+    except Exception as e:
+        st.error(f"补齐目录编号失败: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+# 进程内只检查一次是否还有未补齐 folder_id 的旧照片
+_legacy_folders_checked = False
+_legacy_folders_lock = threading.Lock()
+
+def _backfill_legacy_folders(conn):
+    """
+    升级后的首次入库前补齐旧照片的 folder_id (按 idx_folder_id 查，已补齐时只多一次索引查询)
+    分级入库按目录查找没有 QuickHash 的旧记录，folder_id 为空的旧记录会被漏掉而重复入库
+    """
+    global _legacy_folders_checked
+    with _legacy_folders_lock:
+        if _legacy_folders_checked: return
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM drone_photos WHERE folder_id IS NULL AND FullPath IS NOT NULL LIMIT 1")
+        if cursor.fetchone():
+            backfill_folders(conn)
+        _legacy_folders_checked = True
+
+# 进程内“已登记目录”缓存 (folder_id 集合)，首次使用时从 file_dir_tags 预加载
+_known_dirs = None
+_known_dirs_lock = threading.Lock()
+
+def _get_known_dirs(cursor):
+    global _known_dirs
+    if _known_dirs is None:
+        cursor.execute("SELECT folder_id FROM file_dir_tags WHERE folder_id IS NOT NULL")
+        _known_dirs = {row[0] for row in cursor.fetchall()}
+    return _known_dirs
+
+def register_dirs(file_paths):
+    """
+    批量登记一批文件所在的目录：先在内存中去重并按 folder_id 排除已登记的目录，
+    剩下的新目录用一条多行 INSERT IGNORE 写入 file_dir_tags，返回新增目录数
+    """
+    rows = {}
+    for file_path in file_paths:
+        row = _dir_tag_row(file_path)
+        if row:
+            rows.setdefault(row[1], row)
+    if not rows: return 0
+
+    conn = None
+    try:
+        with _known_dirs_lock:
+            if _known_dirs is not None and all(_folder_ids.get(path) in _known_dirs for path in rows):
+                return 0
+
+            conn = get_connection()
+            ids = _ensure_folders(conn, rows)
+            cursor = conn.cursor()
+            known = _get_known_dirs(cursor)
+            new_rows = [row + (ids[path],) for path, row in rows.items() if ids[path] not in known]
+            if not new_rows: return 0
+
+            # 插入或忽略 (如果已存在则不覆盖标记状态)
+            sql = ("INSERT IGNORE INTO file_dir_tags "
+                   "(folder_name, full_path, dir_level_1, dir_level_2, dir_level_3, folder_id) VALUES "
+                   + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(new_rows)))
+            cursor.execute(sql, [v for row in new_rows for v in row])
+            _rebuild_dir_facets(cursor)
+            conn.commit()
+            known.update(row[-1] for row in new_rows)
+            return len(new_rows)
     except Exception as e:
         print(f"目录同步失败: {e}")
+        return 0
     finally:
         if conn: conn.close()
 
-def update_marks_batch(df_changes, mode):
-    if df_changes.empty: return
-    
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    
-    affected_files_count = 0
-    
+def sync_dir_tags(file_path):
+    """
+    解析文件路径，提取目录，存入 file_dir_tags 表
+    """
+    register_dirs([file_path])
+
+def complete_file_hashes(after_id=0, limit=500):
+    """
+    补全分级模式入库、尚未计算完整 MD5 的记录 (每次处理 id > after_id 的最多 limit 条)
+    若补全后发现库中已有相同 MD5 的记录，说明是重复文件，删除后入库的这一条
+    返回 {'updated', 'duplicates', 'unreadable', 'remaining', 'last_id'}，下次从 last_id 继续
+    """
+    result = {'updated': 0, 'duplicates': 0, 'unreadable': 0, 'remaining': 0, 'last_id': after_id}
+    conn = None
     try:
-        #print("------------------- 开始执行批量更新 -----------------------")
-        # 遍历修改过的行
-        for index, row in df_changes.iterrows():
-            
-            # 获取和清洗
-            f_path_file = row.get('full_path') 
-            f_note = row.get('mark_note', '')
-            raw_color = row.get('tag_color')
-            if pd.isna(raw_color) or raw_color in ["⚪ 无", "无", "nan"]:
-                db_color = None
-            else:
-                db_color = raw_color
-            if pd.isna(f_note):
-                f_note = ""
-            else:
-                f_note = str(f_note)
-            
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, FullPath FROM drone_photos WHERE FileHash IS NULL AND id > %s ORDER BY id LIMIT %s",
+            (after_id, limit)
+        )
+        rows = cursor.fetchall()
 
-            if not f_path_file: 
-                print("❌ 跳过：找不到 full_path")
+        for row_id, path in rows:
+            result['last_id'] = row_id
+            full_hash = _file_md5(path)
+            if not full_hash:
+                result['unreadable'] += 1
                 continue
 
-            # 更新 file_dir_tags 表
-            sql_self = "UPDATE file_dir_tags SET tag_color=%s, mark_note=%s WHERE full_path=%s"
-            cursor.execute(sql_self, (db_color, f_note, f_path_file))
+            cursor.execute("SELECT id FROM drone_photos WHERE FileHash = %s LIMIT 1", (full_hash,))
+            if cursor.fetchone():
+                _delete_photos(cursor, [row_id])
+                result['duplicates'] += 1
+            else:
+                cursor.execute("UPDATE drone_photos SET FileHash = %s WHERE id = %s", (full_hash, row_id))
+                result['updated'] += 1
+            cursor.execute("UPDATE file_manifest SET FileHash = %s WHERE FullPath = %s", (full_hash, path))
+            _bump_version(cursor, 'photos')
+            conn.commit()
 
-            if mode == 1:
-                continue
+        cursor.execute("SELECT COUNT(*) FROM drone_photos WHERE FileHash IS NULL AND id > %s", (result['last_id'],))
+        result['remaining'] = cursor.fetchone()[0]
+    except Exception as e:
+        st.error(f"哈希补全失败: {e}")
+    finally:
+        if conn: conn.close()
+    return result
 
-            #parent_folder = os.path.dirname(f_path_file)
-            parent_folder = f_path_file
-            clean_parent = parent_folder.replace('/', '\\') # 确保是反斜杠
-            search_pattern = clean_parent.replace('\\', '\\\\') + '\\\\%'
-            
-            #print(f"处理中: {f_path_file}")
-            #print(f" >> 提取父目录: {clean_parent}")
-            #print(f" >> SQL匹配模式: {search_pattern}")
-
-            sql_sync = """
-            UPDATE drone_photos 
-            SET mark_note = %s 
-            WHERE FullPath LIKE %s
+def _like_prefix(folder_path):
+    """
+    生成“该目录下所有文件”的 LIKE 匹配串，转义路径中的 % _ (转义符为 !，需配合 ESCAPE '!' 使用)
+    反斜杠在 MySQL 和 SQLite 字符串中的含义不同，因此不用它作转义符
+    """
+    folder_path = folder_path.rstrip('\\/') + os.sep
+    escaped = folder_path.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return escaped + '%'
+
+def load_manifest(root_path):
+    """
+    读取某个根目录下的扫描清单，返回 {FullPath: (FileSize, FileMtime)}
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        sql = "SELECT FullPath, FileSize, FileMtime FROM file_manifest WHERE FullPath LIKE %s ESCAPE '!'"
+        cursor.execute(sql, (_like_prefix(os.path.abspath(root_path)),))
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"读取扫描清单失败: {e}")
+        return {}
+    finally:
+        if conn: conn.close()
+
+def upsert_manifest(rows):
+    """
+    写入/更新扫描清单，rows 为 (FullPath, FileSize, FileMtime, FileHash) 列表
+    """
+    if not rows: return
+
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        if is_sqlite():
+            sql = """
+            INSERT INTO file_manifest (FullPath, FileSize, FileMtime, FileHash)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (FullPath) DO UPDATE SET
+                FileSize = excluded.FileSize, FileMtime = excluded.FileMtime, FileHash = excluded.FileHash
+            """
+        else:
+            sql = """
+            INSERT INTO file_manifest (FullPath, FileSize, FileMtime, FileHash)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                FileSize = VALUES(FileSize), FileMtime = VALUES(FileMtime), FileHash = VALUES(FileHash)
             """
-            cursor.execute(sql_sync, (f_note, search_pattern))
-            
-            row_count = cursor.rowcount
-            affected_files_count += row_count
-            #print(f" >> 数据库反馈: 更新了 {row_count} 条记录")
-            
+        cursor.executemany(sql, rows)
+        conn.commit()
+    except Exception as e:
+        print(f"扫描清单写入失败: {e}")
+    finally:
+        if conn: conn.close()
+
+def _create_temp_table(cursor, name, columns_sql):
+    # 连接来自连接池，上次留下的同名临时表先删掉
+    if is_sqlite():
+        cursor.execute(f"DROP TABLE IF EXISTS temp.{name}")
+        cursor.execute(f"CREATE TEMP TABLE {name} ({columns_sql})")
+    else:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {name}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {name} ({columns_sql})")
+
+def _drop_temp_table(cursor, name):
+    cursor.execute(f"DROP TABLE IF EXISTS temp.{name}" if is_sqlite() else f"DROP TEMPORARY TABLE IF EXISTS {name}")
+
+def _folder_targets(folders, targets):
+    """
+    folders 为 [(id, parent_id, path)]，为每个目录找到最近的一个被修改的目录 (自身或上级)，
+    返回 [(folder_id, 被修改的目录)]；子目录单独改过备注时以子目录为准
+    """
+    parents = {folder_id: parent_id for folder_id, parent_id, _ in folders}
+    paths = {folder_id: path for folder_id, _, path in folders}
+    pairs = []
+    for folder_id in parents:
+        node = folder_id
+        while node is not None and node in paths:
+            if paths[node] in targets:
+                pairs.append((folder_id, targets[paths[node]]))
+                break
+            node = parents[node]
+    return pairs
+
+def update_marks_batch(df_changes, mode):
+    """
+    保存目录标记：mode 1 只更新 file_dir_tags；mode 2 同时把备注同步到目录下 (含子目录) 的全部文件
+    修改先写入临时表，再各用一条 UPDATE ... JOIN 完成
+    返回逐行结果 [{'full_path', 'result', 'files'}]：result 为 已保存 / 目录不存在 / 缺少路径，
+    files 为同步了备注的文件数 (mode 1 为 None)；整批失败时返回空列表
+    """
+    if df_changes.empty: return []
+
+    edits = {}
+    outcomes = []
+    for row in df_changes.to_dict('records'):
+        # 获取和清洗
+        f_path_file = row.get('full_path')
+        if not f_path_file or pd.isna(f_path_file):
+            print("❌ 跳过：找不到 full_path")
+            outcomes.append({'full_path': None, 'result': "缺少路径", 'files': None})
+            continue
+        raw_color = row.get('tag_color')
+        if pd.isna(raw_color) or raw_color in ["⚪ 无", "无", "nan"]:
+            db_color = None
+        else:
+            db_color = raw_color
+        f_note = row.get('mark_note', '')
+        f_note = "" if pd.isna(f_note) else str(f_note)
+        edits[f_path_file] = (db_color, f_note)
+    if not edits: return outcomes
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    file_counts = {}
+
+    try:
+        _create_temp_table(cursor, "tmp_dir_marks",
+                           "full_path VARCHAR(768) NOT NULL PRIMARY KEY, tag_color VARCHAR(20), mark_note TEXT")
+        cursor.executemany("INSERT INTO tmp_dir_marks (full_path, tag_color, mark_note) VALUES (%s, %s, %s)",
+                           [(path, color, note) for path, (color, note) in edits.items()])
+        cursor.execute("SELECT t.full_path FROM tmp_dir_marks t JOIN file_dir_tags d ON d.full_path = t.full_path")
+        found = {row[0] for row in cursor.fetchall()}
+
+        # 更新 file_dir_tags 表
+        if is_sqlite():
+            cursor.execute("UPDATE file_dir_tags SET tag_color = t.tag_color, mark_note = t.mark_note "
+                           "FROM tmp_dir_marks AS t WHERE file_dir_tags.full_path = t.full_path")
+        else:
+            cursor.execute("UPDATE file_dir_tags d JOIN tmp_dir_marks t ON d.full_path = t.full_path "
+                           "SET d.tag_color = t.tag_color, d.mark_note = t.mark_note")
+        _drop_temp_table(cursor, "tmp_dir_marks")
+
+        if mode == 2:
+            # 目录 -> 备注来源目录，在内存中沿 folders 的上下级关系匹配 (目录数远小于照片数)
+            cursor.execute("SELECT id, parent_id, path FROM folders")
+            targets = {os.path.normpath(path).replace('\\', '/'): path for path in edits}
+            pairs = _folder_targets(cursor.fetchall(), targets)
+
+            _create_temp_table(cursor, "tmp_folder_notes",
+                               "folder_id INT NOT NULL PRIMARY KEY, src_path VARCHAR(768), mark_note TEXT")
+            cursor.executemany("INSERT INTO tmp_folder_notes (folder_id, src_path, mark_note) VALUES (%s, %s, %s)",
+                               [(folder_id, src, edits[src][1]) for folder_id, src in pairs])
+
+            cursor.execute("SELECT t.src_path, COUNT(*) FROM drone_photos p "
+                           "JOIN tmp_folder_notes t ON p.folder_id = t.folder_id GROUP BY t.src_path")
+            file_counts = {path: 0 for path in edits}
+            file_counts.update({src: cnt for src, cnt in cursor.fetchall()})
+
+            if is_sqlite():
+                cursor.execute("UPDATE drone_photos SET mark_note = t.mark_note "
+                               "FROM tmp_folder_notes AS t WHERE drone_photos.folder_id = t.folder_id")
+            else:
+                cursor.execute("UPDATE drone_photos p JOIN tmp_folder_notes t ON p.folder_id = t.folder_id "
+                               "SET p.mark_note = t.mark_note")
+            _drop_temp_table(cursor, "tmp_folder_notes")
+
+        _bump_version(cursor, 'marks')
         conn.commit()
-        st.toast(f"✅ 保存成功！并同步更新了 {row_count} 个文件的备注。")
+        if mode == 2:
+            st.toast(f"✅ 保存成功！并同步更新了 {len(edits)} 个目录下 {sum(file_counts.values())} 个文件的备注。")
+        else:
+            st.toast(f"✅ 保存成功！已更新 {len(edits)} 个目录的标记。")
         time.sleep(1)
+        outcomes += [{'full_path': path, 'result': "已保存" if path in found else "目录不存在",
+                      'files': file_counts.get(path) if mode == 2 else None} for path in edits]
+        return outcomes
         
     except Exception as e:
         st.error(f"保存失败: {e}")
         print(f"ERROR DETAILS: {e}")
+        return []
     finally:
         if conn: conn.close()
 
@@ -222,7 +1060,7 @@ def update_color_by_hashes(file_hashes, new_color):
     """
     if not file_hashes: return
     
-    conn = mysql.connector.connect(**DB_CONFIG)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -329,7 +1167,7 @@ def process_excel_to_db(uploaded_file):
         cnt += 1
 
     if results_to_insert:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_connection()
         if conn:
             cursor = conn.cursor()
             sql = """
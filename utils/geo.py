@@ -0,0 +1,297 @@
+import numpy as np
+
+
+def shape_ring(geometry):
+    """
+    从地图绘制结果 (GeoJSON Polygon) 取外环坐标，返回 [(经度, 纬度), ...]；不是多边形时返回 None
+    """
+    if not geometry or geometry.get('type') != 'Polygon':
+        return None
+    ring = [(float(p[0]), float(p[1])) for p in geometry['coordinates'][0]]
+    return ring if len(ring) >= 4 else None
+
+
+def ring_bounds(ring):
+    """
+    外环的包围盒 (最小经度, 最小纬度, 最大经度, 最大纬度)
+    """
+    lons = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def is_rectangle(ring):
+    """
+    是否为与经纬线对齐的矩形 (Draw 插件画出的矩形)，矩形只需按包围盒筛选
+    """
+    return len(ring) == 5 and len({p[0] for p in ring}) == 2 and len({p[1] for p in ring}) == 2
+
+
+def ring_wkt(ring):
+    """
+    转成 WKT，x 为经度、y 为纬度，与 geo_point 列一致
+    """
+    if ring[0] != ring[-1]:
+        ring = ring + [ring[0]]
+    return "POLYGON((" + ", ".join(f"{lon!r} {lat!r}" for lon, lat in ring) + "))"
+
+
+def points_in_polygon(lons, lats, ring):
+    """
+    射线法判断一批点是否落在多边形内，按边循环、对点向量化，返回布尔数组
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    inside = np.zeros(len(lons), dtype=bool)
+    xs = np.array([p[0] for p in ring], dtype=float)
+    ys = np.array([p[1] for p in ring], dtype=float)
+    for x1, y1, x2, y2 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+        if y1 == y2: continue
+        crosses = (y1 > lats) != (y2 > lats)
+        x_cross = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (lons < x_cross)
+    return inside
+
+
+def grid_cell_size(zoom):
+    """
+    密度网格某一层的格子边长 (度)：约为该缩放级别下一张瓦片宽度的 1/8
+    """
+    return 360.0 / 2 ** (zoom + 3)
+
+
+def grid_cells(lats, lons, alts, rtk_fixed, zooms):
+    """
+    把一批点按各层网格分箱，返回 [(层级, cx, cy, 点数, 高度和, 有高度的点数, RTK 固定解点数)]
+    cx / cy 为格子在经度 / 纬度方向的整数编号，格子范围为 [cx * 边长, (cx + 1) * 边长)
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    alts = np.asarray(alts, dtype=float)
+    rtk_fixed = np.asarray(rtk_fixed, dtype=float)
+    valid = ~np.isnan(lats) & ~np.isnan(lons) & (lats != 0) & (lons != 0)
+    lats, lons, alts, rtk_fixed = lats[valid], lons[valid], alts[valid], rtk_fixed[valid]
+    if not len(lats):
+        return []
+
+    has_alt = ~np.isnan(alts)
+    alts = np.where(has_alt, alts, 0.0)
+    rows = []
+    for zoom in zooms:
+        size = grid_cell_size(zoom)
+        cx = np.floor(lons / size).astype(np.int64)
+        cy = np.floor(lats / size).astype(np.int64)
+        # 两个编号拼成一个 int64 键，一次 unique 完成分组
+        keys, inverse = np.unique(cx * 2 ** 32 + (cy + 2 ** 31), return_inverse=True)
+        cnt = np.bincount(inverse)
+        alt_sum = np.bincount(inverse, weights=alts)
+        alt_cnt = np.bincount(inverse, weights=has_alt)
+        rtk_cnt = np.bincount(inverse, weights=rtk_fixed)
+        key_cx = keys // 2 ** 32
+        key_cy = keys % 2 ** 32 - 2 ** 31
+        rows += zip([zoom] * len(keys), key_cx.tolist(), key_cy.tolist(), cnt.tolist(), alt_sum.tolist(),
+                    alt_cnt.astype(np.int64).tolist(), rtk_cnt.astype(np.int64).tolist())
+    return rows
+
+
+def view_bounds(lat, lon, zoom, width_px=1200, height_px=600):
+    """
+    由地图中心和缩放级别估算视野 (南, 西, 北, 东)；地图还没返回实际范围时使用
+    """
+    lon_span = 360.0 * width_px / (256 * 2 ** zoom)
+    lat_span = lon_span * height_px / width_px * max(float(np.cos(np.radians(lat))), 0.01)
+    return lat - lat_span / 2, lon - lon_span / 2, lat + lat_span / 2, lon + lon_span / 2
+
+
+def expand_bounds(bounds, margin):
+    """
+    视野四周各外扩 margin 倍的宽 / 高，平移一小段时不必重新查询
+    """
+    south, west, north, east = bounds
+    dy, dx = (north - south) * margin, (east - west) * margin
+    return max(south - dy, -90.0), max(west - dx, -180.0), min(north + dy, 90.0), min(east + dx, 180.0)
+
+
+def bounds_contain(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
+def thin_points(lats, lons, budget, bounds):
+    """
+    按空间均匀抽稀到 budget 个点以内，返回布尔数组
+    范围划成约 budget 个格子，每格保留的点数有同一个上限：稀疏处的点全部保留，密集处被削平
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+    if n <= budget:
+        return np.ones(n, dtype=bool)
+
+    south, west, north, east = bounds
+    side = max(int(np.sqrt(budget)), 1)
+    gx = np.clip(((lons - west) / max(east - west, 1e-12) * side).astype(np.int64), 0, side - 1)
+    gy = np.clip(((lats - south) / max(north - south, 1e-12) * side).astype(np.int64), 0, side - 1)
+    cell = gx * side + gy
+
+    # 格内随机排名 (固定种子，同样的数据每次抽到同样的点)
+    order = np.lexsort((np.random.default_rng(0).random(n), cell))
+    sorted_cell = cell[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_cell)) + 1]
+    counts = np.diff(np.r_[starts, n])
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.repeat(starts, counts)
+
+    # 二分找最大的每格上限 cap，使 sum(min(格内点数, cap)) <= budget
+    low, high = 0, int(counts.max())
+    while low < high:
+        mid = (low + high + 1) // 2
+        if np.minimum(counts, mid).sum() <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    keep = rank < low
+    # 剩余名额均匀分给还有点的格子，每格再多留一个
+    spare = budget - int(keep.sum())
+    if spare > 0:
+        extra = np.flatnonzero(rank == low)
+        keep[extra[np.linspace(0, len(extra) - 1, min(spare, len(extra))).astype(np.int64)]] = True
+    return keep
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def shape_circle(feature, marker_radius=None):
+    """
+    从地图绘制结果取圆形选区，返回 (经度, 纬度, 半径米)；
+    圆形工具的半径在 properties.radius 中，标记点使用 marker_radius，都没有时返回 None
+    """
+    geometry = (feature or {}).get('geometry') or {}
+    if geometry.get('type') != 'Point':
+        return None
+    radius = ((feature.get('properties') or {}).get('radius')) or marker_radius
+    if not radius:
+        return None
+    lon, lat = geometry['coordinates'][:2]
+    return float(lon), float(lat), float(radius)
+
+
+def circle_ring(lon, lat, radius_m):
+    """
+    圆的经纬度包围盒，写成矩形外环，可以直接走矩形查询
+    """
+    dlat = np.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(float(np.cos(np.radians(lat))), 0.01)
+    lon_min, lon_max = lon - dlon, lon + dlon
+    lat_min, lat_max = lat - dlat, lat + dlat
+    return [(lon_min, lat_min), (lon_max, lat_min), (lon_max, lat_max), (lon_min, lat_max), (lon_min, lat_min)]
+
+
+def distance_m(lon, lat, lons, lats):
+    """
+    一个点到一批点的球面距离 (米)，haversine 公式
+    """
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lats - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lats) * np.sin((lons - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _concat_ranges(starts, counts):
+    # 把各段 [起点, 起点 + 长度) 拼成一个下标数组
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+class PointIndex:
+    """
+    内存中的经纬度网格索引：点按格子编号排序，每个非空格子记下在排序结果中的起止位置
+    查询时对包围盒覆盖的每一列格子在有序的格子编号上二分查找，只取出相交的格子，
+    再对格内的候选点精确判断，耗时与命中的格子数相关，与总点数无关。查询结果为点在输入数组中的下标
+    """
+
+    def __init__(self, lats, lons, points_per_cell=16):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        valid = np.flatnonzero(~np.isnan(self.lats) & ~np.isnan(self.lons))
+        if not len(valid):
+            self.size = 1.0
+            self.order = valid
+            self.cell_keys = self.starts = self.counts = np.zeros(0, dtype=np.int64)
+            return
+        # 格子边长按平均每格 points_per_cell 个点估算
+        area = max(np.ptp(self.lats[valid]) * np.ptp(self.lons[valid]), 1e-12)
+        self.size = max(float(np.sqrt(area * points_per_cell / len(valid))), 1e-6)
+        cx = np.floor(self.lons[valid] / self.size).astype(np.int64)
+        cy = np.floor(self.lats[valid] / self.size).astype(np.int64)
+        keys = cx * 2 ** 32 + (cy + 2 ** 31)
+        sort = np.argsort(keys, kind='stable')
+        self.order = valid[sort]
+        # 编号按列 (cx) 优先排序，同一列内按 cy 排序，np.unique 的结果已经有序
+        self.cell_keys, self.starts, self.counts = np.unique(keys[sort], return_index=True, return_counts=True)
+
+    def _candidates(self, ring):
+        lon_min, lat_min, lon_max, lat_max = ring_bounds(ring)
+        if not len(self.cell_keys):
+            return self.order
+        # 只看有点的列，选区远大于数据范围时也不会逐列空转
+        cx_first, cx_last = self.cell_keys[0] // 2 ** 32, self.cell_keys[-1] // 2 ** 32
+        columns = np.arange(max(int(np.floor(lon_min / self.size)), cx_first),
+                            min(int(np.floor(lon_max / self.size)), cx_last) + 1, dtype=np.int64)
+        cy_min = int(np.floor(lat_min / self.size)) + 2 ** 31
+        cy_max = int(np.floor(lat_max / self.size)) + 2 ** 31
+        # 每列的 [cy_min, cy_max] 在有序编号中是连续的一段，二分查找得到起止位置
+        lo = np.searchsorted(self.cell_keys, columns * 2 ** 32 + cy_min, side='left')
+        hi = np.searchsorted(self.cell_keys, columns * 2 ** 32 + cy_max, side='right')
+        cells = _concat_ranges(lo, hi - lo)
+        idx = self.order[_concat_ranges(self.starts[cells], self.counts[cells])]
+        lats, lons = self.lats[idx], self.lons[idx]
+        return idx[(lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)]
+
+    def in_ring(self, ring):
+        """
+        落在矩形 / 多边形选区内的点
+        """
+        idx = self._candidates(ring)
+        if is_rectangle(ring):
+            return idx
+        return idx[points_in_polygon(self.lons[idx], self.lats[idx], ring)]
+
+    def in_circle(self, lon, lat, radius_m):
+        """
+        距 (经度, 纬度) 不超过 radius_m 米的点
+        """
+        idx = self._candidates(circle_ring(lon, lat, radius_m))
+        return idx[distance_m(lon, lat, self.lons[idx], self.lats[idx]) <= radius_m]
+
+
+def simplify_line(lons, lats, tolerance):
+    """
+    Douglas-Peucker 折线抽稀，返回保留点的布尔数组 (首尾必留)
+    tolerance 以经度的度数计；纬度按 1 / cos(平均纬度) 拉伸，与 Web 墨卡托地图上的像素距离一致
+    """
+    x = np.asarray(lons, dtype=float)
+    y = np.asarray(lats, dtype=float)
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+    y = y / max(float(np.cos(np.radians(y.mean()))), 0.01)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2: continue
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        norm = np.hypot(dx, dy)
+        # 中间各点到首尾连线的距离 (首尾重合时取到首点的距离)
+        dist = np.abs(px * dy - py * dx) / norm if norm > 0 else np.hypot(px, py)
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return keep
@@ -0,0 +1,239 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from config import INGEST_CONFIG
+from utils.parser import parse_dji_metadata
+from utils.database import bulk_save_to_db, register_dirs, load_manifest, upsert_manifest
+
+_DONE = object()  # 写库队列结束标记
+
+
+def _parse_file(full_path, hash_mode='full'):
+    """
+    解析线程/进程中执行：打开文件并解析元数据，异常抛回分发线程记录
+    """
+    with open(full_path, 'rb') as f:
+        return parse_dji_metadata(f, os.path.basename(full_path), full_path=full_path, hash_mode=hash_mode,
+                                  raise_on_error=True)
+
+
+def scan_files(root_path, exts):
+    """
+    递归扫描目录，返回 [(绝对路径, 大小, 修改时间ns)]；用 scandir 顺带拿到 stat，不打开文件
+    """
+    results = []
+    stack = [os.path.abspath(root_path)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(exts):
+                            st_info = entry.stat()
+                            results.append((entry.path, st_info.st_size, st_info.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    results.sort()
+    return results
+
+
+def filter_changed(root_path, scanned):
+    """
+    与扫描清单比对，只保留新增或大小/修改时间发生变化的文件
+    """
+    manifest = load_manifest(root_path)
+    return [item for item in scanned if manifest.get(item[0]) != (item[1], item[2])]
+
+
+class IngestEngine:
+    """
+    并行入库引擎
+
+    多个解析 worker 并行执行 parse_dji_metadata，结果经有界队列交给唯一的写库线程，
+    由它攒批调用 save_to_db。队列写满时解析端会阻塞 (背压)，数据库慢时内存不会无限增长。
+    页面只需轮询 snapshot() 更新进度。
+    """
+
+    def __init__(self, file_list, workers=None, batch_size=None, queue_size=None, executor=None, stat_map=None,
+                 hash_mode=None):
+        self.file_list = list(file_list)
+        self.stat_map = stat_map or {}  # {绝对路径: (大小, 修改时间ns)}，入库后写回扫描清单
+        self.workers = max(1, int(workers or INGEST_CONFIG['workers']))
+        self.batch_size = max(1, int(batch_size or INGEST_CONFIG['batch_size']))
+        self.queue_size = max(1, int(queue_size or INGEST_CONFIG['queue_size']))
+        self.executor = executor or INGEST_CONFIG['executor']
+        self.hash_mode = hash_mode or INGEST_CONFIG['hash_mode']
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.counters = {
+            'total': len(self.file_list),
+            'parsed': 0,     # 解析成功
+            'failed': 0,     # 解析失败 / 非大疆文件
+            'written': 0,    # 已提交给数据库的记录数
+            'inserted': 0,   # 实际新增的记录数 (去重后)
+            'skipped': 0,    # 库中已存在而跳过的记录数
+            'bytes': 0,      # 已解析文件的总大小
+            'bytes_read': 0,  # 解析时实际读取的字节数 (由各 worker 随元数据带回，进程池下同样有效)
+            'batches': 0,
+            'last_file': "",
+            'last_error': "",  # 最近一次解析失败的原因，由页面线程显示
+        }
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    # ---------------- 对外接口 ----------------
+    def start(self):
+        self.started_at = time.time()
+        self._threads = [
+            threading.Thread(target=self._dispatch, name="ingest-dispatch", daemon=True),
+            threading.Thread(target=self._write, name="ingest-writer", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def cancel(self):
+        self._stop.set()
+
+    def is_running(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.counters)
+        snap['done'] = snap['parsed'] + snap['failed']
+        snap['queued'] = self._queue.qsize()
+        end = self.finished_at or time.time()
+        snap['elapsed'] = end - self.started_at if self.started_at else 0.0
+        snap['files_per_sec'] = snap['done'] / snap['elapsed'] if snap['elapsed'] > 0 else 0.0
+        snap['read_ratio'] = snap['bytes_read'] / snap['bytes'] if snap['bytes'] else 0.0
+        return snap
+
+    # ---------------- 内部实现 ----------------
+    def _count(self, **kwargs):
+        with self._lock:
+            for k, v in kwargs.items():
+                if k in ('last_file', 'last_error'):
+                    self.counters[k] = v
+                else:
+                    self.counters[k] += v
+
+    def _dispatch(self):
+        """
+        分发线程：控制在途任务数量，把解析结果放入有界队列
+        """
+        pool_cls = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+        max_inflight = self.workers * 2
+        pending = set()
+        paths = iter(self.file_list)
+        exhausted = False
+
+        try:
+            with pool_cls(max_workers=self.workers) as pool:
+                while not self._stop.is_set():
+                    while not exhausted and len(pending) < max_inflight:
+                        path = next(paths, None)
+                        if path is None:
+                            exhausted = True
+                            break
+                        fut = pool.submit(_parse_file, path, self.hash_mode)
+                        fut.path = path
+                        pending.add(fut)
+
+                    if not pending:
+                        break
+
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        try:
+                            meta = fut.result()
+                        except Exception as e:
+                            self._count(failed=1, last_file=os.path.basename(fut.path),
+                                        last_error=f"{os.path.basename(fut.path)}: {e}")
+                            continue
+                        if not meta:
+                            self._count(failed=1, last_file=os.path.basename(fut.path))
+                            continue
+                        bytes_read = meta.pop('BytesRead', 0)  # 只用于统计，不入库
+                        # 队列满时在这里阻塞，解析端随之停止提交新任务
+                        while not self._stop.is_set():
+                            try:
+                                self._queue.put(meta, timeout=0.5)
+                                break
+                            except queue.Full:
+                                continue
+                        self._count(parsed=1, bytes=meta.get('FileSize') or 0, bytes_read=bytes_read,
+                                    last_file=os.path.basename(fut.path))
+
+                if self._stop.is_set():
+                    for fut in pending:
+                        fut.cancel()
+        except Exception as e:
+            self.error = e
+        finally:
+            # 写库线程异常退出后不再等待队列空位
+            while True:
+                try:
+                    self._queue.put(_DONE, timeout=0.5)
+                    break
+                except queue.Full:
+                    if not self._threads[1].is_alive():
+                        break
+
+    def _flush(self, batch):
+        # 写库失败直接抛出，让引擎停止，且不会把这批文件记入扫描清单
+        reports = bulk_save_to_db(batch, batch_size=self.batch_size, raise_on_error=True)
+        inserted = sum(r['inserted'] for r in reports)
+        # 每批只登记一次目录 (批内去重，已知目录直接跳过)
+        register_dirs([meta.get('FullPath') for meta in batch])
+        manifest_rows = []
+        for meta in batch:
+            sig = self.stat_map.get(meta.get('FullPath'))
+            if sig:
+                manifest_rows.append((meta['FullPath'], sig[0], sig[1], meta.get('FileHash')))
+        upsert_manifest(manifest_rows)
+        self._count(written=len(batch), inserted=inserted, skipped=len(batch) - inserted, batches=1)
+
+    def _write(self):
+        """
+        写库线程：唯一持有数据库连接的一方，按 batch_size 攒批写入
+        """
+        batch = []
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        except Exception as e:
+            self.error = e
+            # 写库失败时停止解析，并清空队列以解除分发线程的阻塞
+            self._stop.set()
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            self.finished_at = time.time()
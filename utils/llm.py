@@ -1,7 +1,7 @@
 from openai import OpenAI
 import re
 
-from config import API_BASE, API_KEY
+from config import API_BASE, API_KEY, DB_CONFIG
 
 
 def generate_sql_from_ai(user_question, api_key=API_KEY, base_url=API_BASE):
@@ -13,9 +13,10 @@ def generate_sql_from_ai(user_question, api_key=API_KEY, base_url=API_BASE):
         return None, "API Key 未配置"
 
     client = OpenAI(api_key=api_key, base_url=base_url)
+    dialect = "SQLite" if DB_CONFIG.get('backend') == 'sqlite' else "MySQL"
 
-    schema_info = """
-    这是 MySQL 数据库，主要内容是无人机航拍图片，包含一张表：
+    schema_info = f"""
+    这是 {dialect} 数据库，主要内容是无人机航拍图片，包含一张表：
 
     Table: drone_photos (航拍照片表)
     - filename (文件名, e.g., 'DJI_001.JPG')
@@ -69,7 +70,7 @@ FlightLineInfo,当前飞行航线/任务的唯一识别 ID。
         response = client.chat.completions.create(
             model="deepseek-chat",
             messages=[
-                {"role": "system", "content": f"你是一个专业的 MySQL 助手。{schema_info}"},
+                {"role": "system", "content": f"你是一个专业的 {dialect} 助手。{schema_info}"},
                 {"role": "user", "content": f"请将此问题转换为 SQL: {user_question}"}
             ],
             temperature=0.1,
@@ -0,0 +1,133 @@
+"""
+MySQL 与 SQLite 之间的数据迁移 / 导出
+
+用法 (在项目根目录执行)：
+    python -m utils.migrate mysql sqlite                 # MySQL -> DB_CONFIG['sqlite_path']
+    python -m utils.migrate sqlite mysql --sqlite-path field.db
+    python -m utils.migrate mysql sqlite --sqlite-path export.db --clear
+
+MySQL 连接参数取自 config.DB_CONFIG，目标为 MySQL 时需先执行 sql.txt 建表；
+SQLite 文件不存在时会按 sql_sqlite.txt 自动建表。记录的 id 原样保留，重复执行时已存在的 id 会被跳过。
+"""
+import argparse
+import sys
+
+import mysql.connector
+
+from config import DB_CONFIG
+from utils import sqlite_backend
+from utils.database import mysql_params, rebuild_summaries
+
+TABLES = ['folders', 'drone_photos', 'file_dir_tags', 'file_manifest', 'task_hours']
+
+
+def open_backend(backend, sqlite_path=None):
+    """
+    打开指定后端的独立连接 (不走连接池，迁移结束后关闭)
+    """
+    if backend == 'sqlite':
+        return sqlite_backend.connect(sqlite_path or DB_CONFIG['sqlite_path'])
+    if backend == 'mysql':
+        return mysql.connector.connect(**mysql_params())
+    raise ValueError(f"未知的存储后端: {backend}")
+
+
+def _close(conn, backend):
+    if backend == 'sqlite':
+        conn.dispose()
+    else:
+        conn.close()
+
+
+def _table_columns(conn, table):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM `{table}` WHERE 1 = 0")
+    cols = [d[0] for d in cursor.description]
+    cursor.fetchall()
+    cursor.close()
+    return cols
+
+
+def copy_table(src_conn, dst_conn, table, dst_backend, batch_size=1000, clear=False, progress=None):
+    """
+    逐批复制一张表，只复制两边都有的列；目标中已存在的 id / 唯一键直接跳过
+    返回 (读取行数, 新增行数)
+    """
+    cols = [c for c in _table_columns(src_conn, table) if c in set(_table_columns(dst_conn, table))]
+    col_sql = ", ".join(f"`{c}`" for c in cols)
+    # 写成普通 INSERT ... VALUES，mysql.connector 的 executemany 才会合并为多行 INSERT
+    conflict = "ON CONFLICT DO NOTHING" if dst_backend == 'sqlite' else "ON DUPLICATE KEY UPDATE id = id"
+    insert_sql = (f"INSERT INTO `{table}` ({col_sql}) VALUES ("
+                  + ", ".join(["%s"] * len(cols)) + f") {conflict}")
+
+    dst_cursor = dst_conn.cursor()
+    if clear:
+        dst_cursor.execute(f"DELETE FROM `{table}`")
+        dst_conn.commit()
+
+    src_cursor = src_conn.cursor()
+    src_cursor.execute(f"SELECT {col_sql} FROM `{table}` ORDER BY `id`")
+    read_count = 0
+    inserted = 0
+    while True:
+        rows = src_cursor.fetchmany(batch_size)
+        if not rows: break
+        dst_cursor.executemany(insert_sql, [tuple(row) for row in rows])
+        inserted += max(dst_cursor.rowcount, 0)
+        dst_conn.commit()
+        read_count += len(rows)
+        if progress:
+            progress(table, read_count)
+    src_cursor.close()
+    dst_cursor.close()
+    return read_count, inserted
+
+
+def migrate(source, target, sqlite_path=None, tables=None, batch_size=1000, clear=False, progress=None):
+    """
+    把 source 后端的数据复制到 target 后端，返回 {表名: (读取行数, 新增行数)}
+    """
+    if source == target:
+        raise ValueError("源和目标不能是同一个后端")
+
+    src_conn = open_backend(source, sqlite_path)
+    dst_conn = open_backend(target, sqlite_path)
+    report = {}
+    try:
+        for table in tables or TABLES:
+            report[table] = copy_table(src_conn, dst_conn, table, target, batch_size=batch_size, clear=clear,
+                                       progress=progress)
+        # 迁移绕过了增量维护，按目标库的全部数据重建各汇总表
+        dst_cursor = dst_conn.cursor()
+        rebuild_summaries(dst_cursor)
+        dst_conn.commit()
+        dst_cursor.close()
+    finally:
+        _close(src_conn, source)
+        _close(dst_conn, target)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在 MySQL 与 SQLite 之间迁移 / 导出数据")
+    parser.add_argument('source', choices=['mysql', 'sqlite'])
+    parser.add_argument('target', choices=['mysql', 'sqlite'])
+    parser.add_argument('--sqlite-path', default=None, help="SQLite 数据库文件，默认 DB_CONFIG['sqlite_path']")
+    parser.add_argument('--tables', nargs='+', default=None, choices=TABLES)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--clear', action='store_true', help="复制前先清空目标表")
+    args = parser.parse_args(argv)
+
+    def progress(table, count):
+        print(f"\r{table}: {count} 行", end="", flush=True)
+
+    report = migrate(args.source, args.target, sqlite_path=args.sqlite_path, tables=args.tables,
+                     batch_size=args.batch_size, clear=args.clear, progress=progress)
+    print()
+    for table, (read_count, inserted) in report.items():
+        print(f"{table}: 读取 {read_count} 行，新增 {inserted} 行")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
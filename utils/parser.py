@@ -1,19 +1,460 @@
 import streamlit as st
 import os
 import re
+import io
+import hashlib
+import struct
 import exifread
-from datetime import datetime
-import re
+from datetime import datetime, timedelta
 from hachoir.parser import createParser
 from hachoir.metadata import extractMetadata
 
-from utils.common import calculate_md5
 
+READ_CHUNK_SIZE = 1024 * 1024  # 视频分块读取的块大小 (1 MB)
+QUICK_HASH_BYTES = 64 * 1024  # 快速指纹取文件首尾各 64 KB
+
+EXIF_SIGNATURE = b'Exif\x00\x00'
+XMP_SIGNATURE = b'http://ns.adobe.com/xap/1.0/\x00'
+XMP_EXT_SIGNATURE = b'http://ns.adobe.com/xmp/extension/\x00'
+DJI_ATTR_PATTERN = re.compile(rb'drone-dji:(\w+)="([^"]+)"')  # 一次扫描取出全部 drone-dji 属性
+
+# (字段名, XMP 属性名, 类型)
+XMP_FIELDS = [
+    ('Version', 'Version', str), ('ImageSource', 'ImageSource', str),
+    ('GpsStatus', 'GpsStatus', str), ('AltitudeType', 'AltitudeType', str),
+    ('SurveyingMode', 'SurveyingMode', str), ('CameraSerialNumber', 'CameraSerialNumber', str),
+    ('DroneModel', 'DroneModel', str), ('DroneSerialNumber', 'DroneSerialNumber', str),
+    ('LRFStatus', 'LRFStatus', str), ('FlightLineInfo', 'FlightLineInfo', str),
+    ('RelativeAltitude', 'RelativeAltitude', float), ('GimbalRollDegree', 'GimbalRollDegree', float),
+    ('GimbalYawDegree', 'GimbalYawDegree', float), ('GimbalPitchDegree', 'GimbalPitchDegree', float),
+    ('FlightRollDegree', 'FlightRollDegree', float), ('FlightYawDegree', 'FlightYawDegree', float),
+    ('FlightPitchDegree', 'FlightPitchDegree', float), ('FlightXSpeed', 'FlightXSpeed', float),
+    ('FlightYSpeed', 'FlightYSpeed', float), ('FlightZSpeed', 'FlightZSpeed', float),
+    ('RtkStdLon', 'RtkStdLon', float), ('RtkStdLat', 'RtkStdLat', float),
+    ('RtkStdHgt', 'RtkStdHgt', float), ('LRFTargetDistance', 'LRFTargetDistance', float),
+    ('LRFTargetLon', 'LRFTargetLon', float), ('LRFTargetLat', 'LRFTargetLat', float),
+    ('LRFTargetAlt', 'LRFTargetAlt', float), ('LRFTargetAbsAlt', 'LRFTargetAbsAlt', float),
+    ('AbsoluteAltitude', 'AbsoluteAltitude', float),
+    ('CamReverse', 'CamReverse', int), ('GimbalReverse', 'GimbalReverse', int),
+    ('RtkFlag', 'RtkFlag', int),
+]
+
+class _CountingStream:
+    """
+    包装文件流，累计 read() 实际返回的字节数 (读盘统计)，其余属性原样转发
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _read_whole(file_stream):
+    """
+    一次读入整个文件 (图片)，MD5、大小、EXIF、XMP 都从这份内存数据中获取
+    """
+    file_stream.seek(0)
+    buf = file_stream.read()
+    return buf, hashlib.md5(buf).hexdigest()
+
+
+def _hash_stream(file_stream):
+    """
+    分块流式读取一遍 (视频)，同时得到 MD5、文件大小以及首尾各 QUICK_HASH_BYTES 字节
+    """
+    hash_md5 = hashlib.md5()
+    size = 0
+    head = b""
+    tail = b""
+    file_stream.seek(0)
+    for chunk in iter(lambda: file_stream.read(READ_CHUNK_SIZE), b""):
+        hash_md5.update(chunk)
+        size += len(chunk)
+        if len(head) < QUICK_HASH_BYTES:
+            head += chunk[:QUICK_HASH_BYTES - len(head)]
+        tail = (tail + chunk)[-QUICK_HASH_BYTES:]
+    file_stream.seek(0)
+    return hash_md5.hexdigest(), size, head, tail
+
+
+def _stream_size(file_stream):
+    file_stream.seek(0, os.SEEK_END)
+    size = file_stream.tell()
+    file_stream.seek(0)
+    return size
+
+
+def _read_range(file_stream, offset, length):
+    file_stream.seek(offset)
+    return file_stream.read(length)
+
+
+def _read_edges(file_stream, size, head_len):
+    """
+    分级模式只读取文件头 head_len 字节和文件尾 QUICK_HASH_BYTES 字节，返回 (头, 尾, 读取字节数)
+    """
+    head = _read_range(file_stream, 0, head_len)
+    if size <= len(head):
+        tail = head[-QUICK_HASH_BYTES:]
+    else:
+        tail = _read_range(file_stream, max(len(head), size - QUICK_HASH_BYTES), QUICK_HASH_BYTES)
+        if len(tail) < QUICK_HASH_BYTES:
+            tail = (head + tail)[-QUICK_HASH_BYTES:]
+    file_stream.seek(0)
+    return head, tail, len(head) + (len(tail) if size > len(head) else 0)
+
+
+def read_jpeg_segments(file_stream):
+    """
+    按 JPEG 标记逐段跳读直到 SOS (图像数据开始)，只读取 APP1 段的内容
+    返回 ({'exif': TIFF 数据或 None, 'xmp': 完整 XMP 包 (含扩展 XMP)}, 读取字节数)
+    """
+    segments = {'exif': None, 'xmp': b''}
+    extended = {}
+    bytes_read = 0
+
+    file_stream.seek(0)
+    soi = file_stream.read(2)
+    bytes_read += len(soi)
+    if soi != b'\xff\xd8':
+        return segments, bytes_read
+
+    pos = 2
+    while True:
+        header = file_stream.read(4)
+        bytes_read += len(header)
+        if len(header) < 4 or header[0] != 0xFF:
+            break
+        marker = header[1]
+        if marker == 0xFF:  # 填充字节
+            pos += 1
+            file_stream.seek(pos)
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # 无长度字段的独立标记
+            pos += 2
+            file_stream.seek(pos)
+            continue
+        if marker in (0xDA, 0xD9):  # SOS / EOI，元数据到此为止
+            break
 
-def parse_dji_metadata(file_stream, filename=None, full_path=None):  # 读取和解析
-    folder_name = None
-    current_hash = None
+        length = struct.unpack('>H', header[2:4])[0]
+        if marker == 0xE1:
+            payload = file_stream.read(length - 2)
+            bytes_read += len(payload)
+            if payload.startswith(EXIF_SIGNATURE) and segments['exif'] is None:
+                segments['exif'] = payload[len(EXIF_SIGNATURE):]
+            elif payload.startswith(XMP_SIGNATURE) and not segments['xmp']:
+                segments['xmp'] = payload[len(XMP_SIGNATURE):]
+            elif payload.startswith(XMP_EXT_SIGNATURE):
+                # 扩展 XMP：32 字节 GUID + 4 字节总长度 + 4 字节偏移 + 数据
+                chunk = payload[len(XMP_EXT_SIGNATURE):]
+                if len(chunk) >= 40:
+                    offset = struct.unpack('>I', chunk[36:40])[0]
+                    extended[offset] = chunk[40:]
+        pos += 2 + length
+        file_stream.seek(pos)
+
+    if extended:
+        segments['xmp'] += b''.join(extended[k] for k in sorted(extended))
+    file_stream.seek(0)
+    return segments, bytes_read
+
+
+def extract_dji_xmp(xmp_packet):
+    """
+    一次编译正则扫描 XMP 包，返回 {属性名: 字符串值}；同名属性以第一次出现为准
+    """
+    raw = {}
+    for match in DJI_ATTR_PATTERN.finditer(xmp_packet):
+        name = match.group(1).decode('ascii', errors='ignore')
+        if name not in raw:
+            raw[name] = match.group(2).decode('utf-8', errors='ignore')
+    return raw
+
+
+def _exif_stream(tiff_data):
+    """
+    把 APP1 中的 EXIF 数据包装成最小 JPEG，供 exifread 解析
+    """
+    app1 = EXIF_SIGNATURE + tiff_data
+    return io.BytesIO(b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xd9')
+
+
+# TIFF 数据类型 -> (单个值字节数, struct 格式)
+_TIFF_TYPES = {
+    1: (1, 'B'), 2: (1, 's'), 3: (2, 'H'), 4: (4, 'I'),
+    5: (8, 'II'), 7: (1, 'B'), 9: (4, 'i'), 10: (8, 'ii'),
+}
+_TAG_MODEL, _TAG_EXIF_IFD, _TAG_GPS_IFD, _TAG_DATETIME_ORIGINAL = 0x0110, 0x8769, 0x8825, 0x9003
+_GPS_LAT_REF, _GPS_LAT, _GPS_LON_REF, _GPS_LON, _GPS_ALT = 1, 2, 3, 4, 6
+
+
+def _read_ifd(tiff, endian, offset, wanted):
+    """
+    读取一个 IFD，只解码 wanted 中的标签，返回 {tag: 值}
+    """
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    values = {}
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, typ, n = struct.unpack_from(endian + 'HHI', tiff, entry)
+        if tag not in wanted or typ not in _TIFF_TYPES:
+            continue
+        size, fmt = _TIFF_TYPES[typ]
+        data_offset = entry + 8 if size * n <= 4 else struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+        raw = tiff[data_offset:data_offset + size * n]
+        if len(raw) < size * n:
+            raise ValueError(f"IFD 标签 {tag:#x} 越界")
+
+        if typ == 2:
+            values[tag] = raw.split(b'\x00', 1)[0].decode('utf-8', errors='ignore').strip()
+        elif typ in (5, 10):
+            nums = struct.unpack(endian + fmt[0] * (2 * n), raw)
+            values[tag] = [nums[k] / nums[k + 1] if nums[k + 1] else 0.0 for k in range(0, 2 * n, 2)]
+        else:
+            values[tag] = list(struct.unpack(endian + fmt * n, raw))
+    return values
+
+
+def _dms_to_degrees(dms, ref):
+    val = dms[0] + (dms[1] / 60.0) + (dms[2] / 3600.0)
+    if str(ref).upper() in ['S', 'W']: val = -val
+    return val
+
+
+def read_exif_fields(tiff):
+    """
+    轻量 EXIF 读取：直接跳到 IFD0 / EXIF IFD / GPS IFD，只解码拍摄时间、机型、GPS 经纬度和高度
+    返回 {'DateTimeOriginal', 'Model', 'GpsLatitude', 'GpsLongitude', 'GpsAltitude'}，缺失为 None
+    """
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        raise ValueError("不是 TIFF 数据")
+    if struct.unpack_from(endian + 'H', tiff, 2)[0] != 42:
+        raise ValueError("TIFF 标识错误")
+
+    ifd0 = _read_ifd(tiff, endian, struct.unpack_from(endian + 'I', tiff, 4)[0],
+                     {_TAG_MODEL, _TAG_EXIF_IFD, _TAG_GPS_IFD})
+    exif_ifd = {}
+    if _TAG_EXIF_IFD in ifd0:
+        exif_ifd = _read_ifd(tiff, endian, ifd0[_TAG_EXIF_IFD][0], {_TAG_DATETIME_ORIGINAL})
+    gps_ifd = {}
+    if _TAG_GPS_IFD in ifd0:
+        gps_ifd = _read_ifd(tiff, endian, ifd0[_TAG_GPS_IFD][0],
+                            {_GPS_LAT_REF, _GPS_LAT, _GPS_LON_REF, _GPS_LON, _GPS_ALT})
+
+    fields = {
+        'DateTimeOriginal': exif_ifd.get(_TAG_DATETIME_ORIGINAL),
+        'Model': ifd0.get(_TAG_MODEL),
+        'GpsLatitude': None, 'GpsLongitude': None, 'GpsAltitude': None,
+    }
+    if len(gps_ifd.get(_GPS_LAT, [])) == 3 and len(gps_ifd.get(_GPS_LON, [])) == 3:
+        fields['GpsLatitude'] = _dms_to_degrees(gps_ifd[_GPS_LAT], gps_ifd.get(_GPS_LAT_REF, 'N'))
+        fields['GpsLongitude'] = _dms_to_degrees(gps_ifd[_GPS_LON], gps_ifd.get(_GPS_LON_REF, 'E'))
+    if gps_ifd.get(_GPS_ALT):
+        fields['GpsAltitude'] = gps_ifd[_GPS_ALT][0]
+    return fields
+
+
+def _read_exif_fields_exifread(tiff):
+    """
+    兜底：原生读取失败的非常规文件交给 exifread，返回与 read_exif_fields 相同的结构
+    """
+    tags = exifread.process_file(_exif_stream(tiff), details=False)
+    fields = {
+        'DateTimeOriginal': str(tags['EXIF DateTimeOriginal']) if 'EXIF DateTimeOriginal' in tags else None,
+        'Model': str(tags['Image Model']) if 'Image Model' in tags else None,
+        'GpsLatitude': None, 'GpsLongitude': None, 'GpsAltitude': None,
+    }
+    if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+        fields['GpsLatitude'] = convert_gps(tags['GPS GPSLatitude'], tags.get('GPS GPSLatitudeRef', 'N'))
+        fields['GpsLongitude'] = convert_gps(tags['GPS GPSLongitude'], tags.get('GPS GPSLongitudeRef', 'E'))
+    if 'GPS GPSAltitude' in tags:
+        val = tags['GPS GPSAltitude'].values[0]
+        fields['GpsAltitude'] = float(val.num) / float(val.den)
+    return fields
 
+
+def quick_fingerprint(size, head, tail, capture_id=""):
+    """
+    快速指纹：文件大小 + 首尾各 QUICK_HASH_BYTES 字节 + 拍摄 UUID/时间
+    只用于预筛选，碰撞时再用完整 MD5 判定是否真正重复
+    """
+    hash_quick = hashlib.md5()
+    hash_quick.update(str(size).encode())
+    hash_quick.update(head[:QUICK_HASH_BYTES])
+    hash_quick.update(tail[-QUICK_HASH_BYTES:])
+    hash_quick.update(str(capture_id).encode('utf-8', errors='ignore'))
+    return hash_quick.hexdigest()
+
+
+MP4_EPOCH = datetime(1904, 1, 1)  # MP4/MOV 时间戳从 1904-01-01 (UTC) 起算
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class _BoxReader:
+    """
+    在可 seek 的流上按 box 跳读，只读取需要的叶子 box，并统计读取字节数
+    """
+
+    def __init__(self, file_stream, size):
+        self.stream = file_stream
+        self.size = size
+        self.bytes_read = 0
+
+    def read_at(self, offset, length):
+        self.stream.seek(offset)
+        data = self.stream.read(length)
+        self.bytes_read += len(data)
+        return data
+
+    def boxes(self, start, end):
+        """
+        遍历 [start, end) 范围内的 box，返回 (类型, 内容起点, 内容终点)
+        """
+        pos = start
+        while pos + 8 <= end:
+            header = self.read_at(pos, 8)
+            if len(header) < 8:
+                return
+            box_size, box_type = struct.unpack('>I4s', header)
+            header_len = 8
+            if box_size == 1:  # 64 位长度
+                box_size = struct.unpack('>Q', self.read_at(pos + 8, 8))[0]
+                header_len = 16
+            elif box_size == 0:  # 延伸到文件末尾
+                box_size = end - pos
+            if box_size < header_len:
+                return
+            yield box_type, pos + header_len, min(pos + box_size, end)
+            pos += box_size
+
+
+def _parse_full_box_times(payload, with_track_id=False):
+    """
+    解析 mvhd/mdhd/tkhd 的时间字段，返回 (创建时间秒, timescale 或 None, duration, 其余内容起点)
+    """
+    version = payload[0]
+    if version == 1:
+        creation = struct.unpack_from('>Q', payload, 4)[0]
+        if with_track_id:  # tkhd: creation, modification, track_id, reserved, duration
+            duration = struct.unpack_from('>Q', payload, 28)[0]
+            return creation, None, duration, 36
+        timescale, duration = struct.unpack_from('>IQ', payload, 20)
+        return creation, timescale, duration, 32
+    creation = struct.unpack_from('>I', payload, 4)[0]
+    if with_track_id:
+        duration = struct.unpack_from('>I', payload, 20)[0]
+        return creation, None, duration, 24
+    timescale, duration = struct.unpack_from('>II', payload, 12)
+    return creation, timescale, duration, 20
+
+
+def read_mp4_metadata(file_stream, size=None):
+    """
+    MP4/MOV box 解析：沿顶层 box 跳到 moov，只读取 mvhd / tkhd / mdhd / hdlr / stsd / stts
+    返回 ({'creation_time', 'duration', 'width', 'height', 'frame_rate'}, 读取字节数)，无 moov 时返回 (None, n)
+    """
+    if size is None:
+        size = _stream_size(file_stream)
+    reader = _BoxReader(file_stream, size)
+    result = {'creation_time': None, 'duration': None, 'width': None, 'height': None, 'frame_rate': None}
+
+    moov = next(((s, e) for t, s, e in reader.boxes(0, size) if t == b'moov'), None)
+    if moov is None:
+        file_stream.seek(0)
+        return None, reader.bytes_read
+
+    def walk_track(start, end, track):
+        for box_type, s, e in reader.boxes(start, end):
+            if box_type in _MP4_CONTAINERS:
+                walk_track(s, e, track)
+            elif box_type == b'tkhd':
+                payload = reader.read_at(s, min(e - s, 96))
+                _, _, _, rest = _parse_full_box_times(payload, with_track_id=True)
+                # rest 之后：reserved 8 + layer/alternate/volume/reserved 8 + matrix 36，然后是 16.16 定点宽高
+                w, h = struct.unpack_from('>II', payload, rest + 52)
+                track['tkhd_size'] = (w >> 16, h >> 16)
+            elif box_type == b'mdhd':
+                _, track['timescale'], _, _ = _parse_full_box_times(reader.read_at(s, min(e - s, 36)))
+            elif box_type == b'hdlr':
+                track['handler'] = reader.read_at(s, 12)[8:12]
+            elif box_type == b'stsd':
+                entry = reader.read_at(s, min(e - s, 8 + 36))
+                if len(entry) >= 44:  # 视觉样本描述中的宽高
+                    track['stsd_size'] = struct.unpack_from('>HH', entry, 8 + 32)
+            elif box_type == b'stts':
+                count = struct.unpack('>I', reader.read_at(s + 4, 4))[0]
+                table = reader.read_at(s + 8, min(count * 8, e - s - 8))
+                pairs = struct.unpack('>' + 'I' * (len(table) // 4), table)
+                track['samples'] = sum(pairs[0::2])
+                track['sample_delta_sum'] = sum(c * d for c, d in zip(pairs[0::2], pairs[1::2]))
+
+    for box_type, s, e in reader.boxes(*moov):
+        if box_type == b'mvhd':
+            creation, timescale, duration, _ = _parse_full_box_times(reader.read_at(s, min(e - s, 32)))
+            if creation:
+                result['creation_time'] = MP4_EPOCH + timedelta(seconds=creation)
+            if timescale:
+                result['duration'] = duration / timescale
+        elif box_type == b'trak':
+            track = {}
+            walk_track(s, e, track)
+            if track.get('handler') != b'vide' or result['width']:
+                continue
+            frame_size = track.get('tkhd_size')
+            if not frame_size or not all(frame_size):
+                frame_size = track.get('stsd_size') or (None, None)
+            result['width'], result['height'] = frame_size
+            if track.get('samples') and track.get('sample_delta_sum') and track.get('timescale'):
+                result['frame_rate'] = round(track['samples'] * track['timescale'] / track['sample_delta_sum'], 3)
+
+    file_stream.seek(0)
+    return result, reader.bytes_read
+
+
+def _read_video_hachoir(video_path):
+    """
+    兜底：box 解析失败的文件交给 hachoir (只用于本地/NAS 路径，不再复制临时文件)
+    """
+    result = {'creation_time': None, 'duration': None, 'width': None, 'height': None, 'frame_rate': None}
+    parser = createParser(video_path)
+    if not parser:
+        return None
+    with parser:
+        metadata = extractMetadata(parser)
+        if not metadata:
+            return None
+        if metadata.has('creation_date'):
+            result['creation_time'] = metadata.get('creation_date')
+        if metadata.has('width') and metadata.has('height'):
+            result['width'] = metadata.get('width')
+            result['height'] = metadata.get('height')
+        if metadata.has('duration'):
+            result['duration'] = metadata.get('duration').total_seconds()
+        if metadata.has('frame_rate'):
+            result['frame_rate'] = metadata.get('frame_rate')
+    return result
+
+
+def parse_dji_metadata(file_stream, filename=None, full_path=None, hash_mode='full', raise_on_error=False):  # 读取和解析
+    """
+    hash_mode='full'   : 读取整个文件，计算完整 MD5 (FileHash)
+    hash_mode='tiered' : 只读取文件头尾计算快速指纹 (QuickHash)，FileHash 留空，碰撞或补全时再计算
+    raise_on_error=True 时解析异常直接抛出 (后台 worker 中没有页面上下文，st.error 不会显示)
+    BytesRead 为本次解析实际从流中读取的字节数 (读盘统计用，不入库)
+    """
     data = {
         'filename': filename if filename else "Uploaded_Image",
         'capture_time': None, 'DroneModel': None, 'Version': None,
@@ -26,159 +467,131 @@ def parse_dji_metadata(file_stream, filename=None, full_path=None):  # 读取和
         'RtkFlag': None, 'RtkStdLon': None, 'RtkStdLat': None, 'RtkStdHgt': None,
         'SurveyingMode': None, 'FlightLineInfo': None, 'LRFStatus': None,
         'LRFTargetDistance': None, 'LRFTargetLon': None, 'LRFTargetLat': None,
-        'LRFTargetAlt': None, 'LRFTargetAbsAlt': None, 'FileSize': 0, "FolderName": folder_name,
-        "FileHash": current_hash, 'FullPath': full_path, 'FileType': 'Unknown',
-        'VideoDuration': None, 'VideoFrameRate': None, 'VideoWidth': None, 'VideoHeight': None
+        'LRFTargetAlt': None, 'LRFTargetAbsAlt': None, 'FileSize': 0, "FolderName": None,
+        "FileHash": None, 'QuickHash': None, 'FullPath': full_path, 'FileType': 'Unknown',
+        'VideoDuration': None, 'VideoFrameRate': None, 'VideoWidth': None, 'VideoHeight': None,
+        'BytesRead': 0
     }
 
     if full_path:
-        current_hash = calculate_md5(full_path)
+        # 只处理路径字符串，不触碰文件内容 (哈希和大小在下面的单次读取中获得)
+        data['FullPath'] = os.path.abspath(full_path)  # 确保是绝对路径
         try:
-            folder_name = os.path.basename(os.path.dirname(full_path))
+            data['FolderName'] = os.path.basename(os.path.dirname(full_path))
         except:
-            folder_name = "Unknown"
-    else:
-        current_hash = calculate_md5(file_stream)
-
-    if full_path and os.path.exists(full_path):
-        data['FullPath'] = os.path.abspath(full_path)  # 确保是绝对路径
-        # data['FileSize'] = os.path.getsize(full_path)
-        data['FolderName'] = os.path.basename(os.path.dirname(full_path))
-        data['FileHash'] = calculate_md5(full_path)
+            data['FolderName'] = "Unknown"
 
     try:
         if isinstance(file_stream, str) and os.path.exists(file_stream):
-            data['FileSize'] = os.path.getsize(file_stream)
             with open(file_stream, 'rb') as f:
-                return parse_dji_metadata(f, filename=os.path.basename(file_stream))
-
-            # 如果是 Streamlit 上传的文件流 / 打开的文件对象
-        else:
-            # 尝试获取大小
-            try:
-                # 移动指针到最后获取大小，再移回来
-                file_stream.seek(0, os.SEEK_END)
-                data['FileSize'] = file_stream.tell()
-                file_stream.seek(0)
-            except:
-                pass
+                return parse_dji_metadata(f, filename=os.path.basename(file_stream), full_path=full_path,
+                                          hash_mode=hash_mode, raise_on_error=raise_on_error)
 
+        # 以下所有读取都经过计数包装，hachoir 兜底时自行打开文件，不计入
+        file_stream = _CountingStream(file_stream)
         ext = os.path.splitext(data['filename'])[1].lower()
         if ext in ['.jpg', '.jpeg']:
             data['FileType'] = ext
-            # 1. 读取 EXIF
-            # 注意：Streamlit上传的文件对象指针可能需要重置
-            file_stream.seek(0)
-            tags = exifread.process_file(file_stream, details=False)
+            if hash_mode == 'tiered':
+                # 0. 分级模式：按标记跳读 APP1 段，再读首尾各 64 KB 计算快速指纹
+                data['FileSize'] = _stream_size(file_stream)
+                segments, _ = read_jpeg_segments(file_stream)
+                head, tail, _ = _read_edges(file_stream, data['FileSize'], QUICK_HASH_BYTES)
+            else:
+                # 0. 单次读取：整个文件只从磁盘/NAS 读一遍，之后都在内存中解析
+                buf, data['FileHash'] = _read_whole(file_stream)
+                data['FileSize'] = len(buf)
+                head, tail = buf, buf[-QUICK_HASH_BYTES:]
+                segments, _ = read_jpeg_segments(io.BytesIO(buf))
 
-            if 'EXIF DateTimeOriginal' in tags:
+            # 1. 读取 EXIF (只解析 APP1 中的 EXIF 数据，原生读取失败时退回 exifread)
+            exif = {}
+            if segments['exif']:
                 try:
-                    data['capture_time'] = datetime.strptime(str(tags['EXIF DateTimeOriginal']), '%Y:%m:%d %H:%M:%S')
+                    exif = read_exif_fields(segments['exif'])
+                except Exception:
+                    exif = _read_exif_fields_exifread(segments['exif'])
+
+            if exif.get('DateTimeOriginal'):
+                try:
+                    data['capture_time'] = datetime.strptime(exif['DateTimeOriginal'], '%Y:%m:%d %H:%M:%S')
                 except:
                     pass
 
-            data['DroneModel'] = str(tags.get('Image Model', 'Unknown'))
-
-            if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                data['GpsLatitude'] = convert_gps(tags['GPS GPSLatitude'], tags.get('GPS GPSLatitudeRef', 'N'))
-                data['GpsLongitude'] = convert_gps(tags['GPS GPSLongitude'], tags.get('GPS GPSLongitudeRef', 'E'))
-
-            if 'GPS GPSAltitude' in tags:
-                val = tags['GPS GPSAltitude'].values[0]
-                data['AbsoluteAltitude'] = float(val.num) / float(val.den)
-
-            # 2. 读取 XMP
-            file_stream.seek(0)
-            content_str = file_stream.read(50000).decode('utf-8', errors='ignore')
-
-            xmp_map = [
-                ('Version', 'Version', str), ('ImageSource', 'ImageSource', str),
-                ('GpsStatus', 'GpsStatus', str), ('AltitudeType', 'AltitudeType', str),
-                ('SurveyingMode', 'SurveyingMode', str), ('CameraSerialNumber', 'CameraSerialNumber', str),
-                ('DroneModel', 'DroneModel', str), ('DroneSerialNumber', 'DroneSerialNumber', str),
-                ('LRFStatus', 'LRFStatus', str), ('FlightLineInfo', 'FlightLineInfo', str),
-                ('RelativeAltitude', 'RelativeAltitude', float), ('GimbalRollDegree', 'GimbalRollDegree', float),
-                ('GimbalYawDegree', 'GimbalYawDegree', float), ('GimbalPitchDegree', 'GimbalPitchDegree', float),
-                ('FlightRollDegree', 'FlightRollDegree', float), ('FlightYawDegree', 'FlightYawDegree', float),
-                ('FlightPitchDegree', 'FlightPitchDegree', float), ('FlightXSpeed', 'FlightXSpeed', float),
-                ('FlightYSpeed', 'FlightYSpeed', float), ('FlightZSpeed', 'FlightZSpeed', float),
-                ('RtkStdLon', 'RtkStdLon', float), ('RtkStdLat', 'RtkStdLat', float),
-                ('RtkStdHgt', 'RtkStdHgt', float), ('LRFTargetDistance', 'LRFTargetDistance', float),
-                ('LRFTargetLon', 'LRFTargetLon', float), ('LRFTargetLat', 'LRFTargetLat', float),
-                ('LRFTargetAlt', 'LRFTargetAlt', float), ('LRFTargetAbsAlt', 'LRFTargetAbsAlt', float),
-                ('AbsoluteAltitude', 'AbsoluteAltitude', float),
-                ('CamReverse', 'CamReverse', int), ('GimbalReverse', 'GimbalReverse', int),
-                ('RtkFlag', 'RtkFlag', int),
-            ]
-
-            for field, tag, dtype in xmp_map:
-                pattern = r'drone-dji:' + tag + r'="([^"]+)"'
-                match = re.search(pattern, content_str)
-                if match:
+            data['DroneModel'] = exif.get('Model') or 'Unknown'
+
+            if exif.get('GpsLatitude') is not None:
+                data['GpsLatitude'] = exif['GpsLatitude']
+                data['GpsLongitude'] = exif['GpsLongitude']
+
+            if exif.get('GpsAltitude') is not None:
+                data['AbsoluteAltitude'] = exif['GpsAltitude']
+
+            # 2. 读取 XMP：完整的 APP1 XMP 包 (不再截断在 50 KB)，找不到标准 XMP 段时退回扫描文件头
+            xmp_raw = extract_dji_xmp(segments['xmp'] or head[:QUICK_HASH_BYTES])
+
+            for field, tag, dtype in XMP_FIELDS:
+                if tag in xmp_raw:
                     try:
-                        val = match.group(1)
+                        val = xmp_raw[tag]
                         if data[field] is None or field not in ['GpsLatitude', 'GpsLongitude']:
                             data[field] = dtype(val)
                     except:
                         pass
 
+            capture_id = f"{xmp_raw.get('CaptureUUID', '')}|{data['capture_time']}"
+            data['QuickHash'] = quick_fingerprint(data['FileSize'], head, tail, capture_id)
+
         elif ext in ['.mp4', '.mov']:
             data['FileType'] = ext
+            if hash_mode == 'tiered':
+                data['FileSize'] = _stream_size(file_stream)
+                head, tail, _ = _read_edges(file_stream, data['FileSize'], QUICK_HASH_BYTES)
+            else:
+                # 单次流式读取：MD5、大小和首尾数据一起得到
+                data['FileHash'], data['FileSize'], head, tail = _hash_stream(file_stream)
+
+            # 直接在原始流上按 box 跳读，本地/NAS 文件和内存中的上传文件都不需要临时文件
+            video = None
+            try:
+                video, _ = read_mp4_metadata(file_stream, data['FileSize'])
+            except Exception as e:
+                print(f"MP4 box 解析失败: {e}")
+            if video is None and full_path:
+                try:
+                    video = _read_video_hachoir(full_path)
+                except Exception as e:
+                    print(f"hachoir 解析失败: {e}")
 
-            video_path_to_parse = None
-            temp_file = None
+            if video:
+                creation_date = video['creation_time']
+                if creation_date:
+                    if creation_date.year <= 2010:
+                        data['capture_time'] = None
+                    else:
+                        data['capture_time'] = creation_date + timedelta(hours=8)  # 修正 UTC+8
 
-            if full_path:
-                video_path_to_parse = full_path
-            elif hasattr(file_stream, 'read'):
-                import tempfile
-                file_stream.seek(0)
-                tfile = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-                tfile.write(file_stream.read())
-                tfile.close()
-                video_path_to_parse = tfile.name
-                temp_file = tfile.name
+                if video['width'] and video['height']:
+                    data['VideoWidth'] = video['width']
+                    data['VideoHeight'] = video['height']
 
-            data['FileHash'] = calculate_md5(full_path)
+                if video['duration'] is not None:
+                    data['VideoDuration'] = round(video['duration'], 2)
 
-            if video_path_to_parse:
-                try:
-                    parser = createParser(video_path_to_parse)
-                    if parser:
-                        with parser:
-                            metadata = extractMetadata(parser)
-                            if metadata:
-                                if metadata.has('creation_date'):
-                                    creation_date = metadata.get('creation_date')
-                                    if creation_date.year <= 2010:
-                                        data['capture_time'] = None
-                                    else:
-                                        from datetime import timedelta
-                                        data['capture_time'] = creation_date + timedelta(hours=8)  # 修正 UTC+8
-
-                                if metadata.has('width') and metadata.has('height'):
-                                    data['VideoWidth'] = metadata.get('width')
-                                    data['VideoHeight'] = metadata.get('height')
-
-                                if metadata.has('duration'):
-                                    duration_delta = metadata.get('duration')
-                                    data['VideoDuration'] = round(duration_delta.total_seconds(), 2)
-
-                                if metadata.has('frame_rate'):
-                                    data['VideoFrameRate'] = metadata.get('frame_rate')
+                if video['frame_rate']:
+                    data['VideoFrameRate'] = video['frame_rate']
 
-                except Exception as e:
-                    print(f"hachoir 解析失败: {e}")
+            data['QuickHash'] = quick_fingerprint(data['FileSize'], head, tail, f"|{data['capture_time']}")
 
-                finally:
-                    if temp_file and os.path.exists(temp_file):
-                        os.remove(temp_file)
+        data['BytesRead'] = file_stream.bytes_read
 
         # 关闭文件流
         if isinstance(file_stream, str) and not file_stream.closed:
             file_stream.close()
 
     except Exception as e:
+        if raise_on_error:
+            raise
         st.error(f"解析错误: {e}")
         return None
     return data
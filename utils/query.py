@@ -0,0 +1,386 @@
+import math
+from datetime import datetime, timedelta, time as dt_time
+
+import pandas as pd
+import streamlit as st
+
+from utils.database import get_connection, get_data_version, is_sqlite, quote_col as _col, RTK_FIXED
+from utils.geo import (shape_ring, shape_circle, ring_bounds, is_rectangle, ring_wkt, circle_ring, distance_m,
+                       points_in_polygon, grid_cell_size)
+from config import MAP_CONFIG
+
+def _like_contains(text):
+    escaped = text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return f"%{escaped}%"
+
+
+def build_where(filters):
+    """
+    把页面筛选条件转换为一条参数化 WHERE 子句，返回 (sql, params)，无条件时 sql 为空串
+
+    filters 可包含：
+        folders            来源文件夹名列表 (按 folders.name 匹配 folder_id)
+        types              文件类型列表
+        date_range         (开始日期, 结束日期)，按天闭区间
+        include_none_date  日期筛选时是否保留无拍摄时间的记录
+        model / version    机型 / 协议版本，None 表示全部
+        rtk                'fixed' 固定解 / 'not_fixed' 非固定解 / None
+        note               备注关键字 (模糊匹配)
+        ranges             {列名: (最小值, 最大值)}
+    """
+    clauses = []
+    params = []
+
+    date_range = filters.get('date_range')
+    if date_range:
+        # 写成 capture_time 上的范围条件，才能用上 idx_capture_time
+        cond = "(capture_time >= %s AND capture_time < %s)"
+        params += [datetime.combine(date_range[0], dt_time.min),
+                   datetime.combine(date_range[1] + timedelta(days=1), dt_time.min)]
+        if filters.get('include_none_date'):
+            cond = f"({cond} OR capture_time IS NULL)"
+        clauses.append(cond)
+
+    if filters.get('folders'):
+        # 按目录名找到 folders.id，再走 drone_photos 的 idx_folder_id
+        values = filters['folders']
+        clauses.append(f"folder_id IN (SELECT id FROM folders WHERE name IN ({', '.join(['%s'] * len(values))}))")
+        params += list(values)
+    if filters.get('types'):
+        values = filters['types']
+        clauses.append(f"FileType IN ({', '.join(['%s'] * len(values))})")
+        params += list(values)
+
+    if filters.get('model'):
+        clauses.append("DroneModel = %s")
+        params.append(filters['model'])
+    if filters.get('version'):
+        clauses.append("Version = %s")
+        params.append(filters['version'])
+
+    if filters.get('rtk') == 'fixed':
+        clauses.append("RtkFlag = %s")
+        params.append(RTK_FIXED)
+    elif filters.get('rtk') == 'not_fixed':
+        clauses.append("(RtkFlag <> %s OR RtkFlag IS NULL)")
+        params.append(RTK_FIXED)
+
+    if filters.get('note'):
+        clauses.append("mark_note LIKE %s ESCAPE '!'")
+        params.append(_like_contains(filters['note']))
+
+    for column, (low, high) in (filters.get('ranges') or {}).items():
+        clauses.append(f"{_col(column)} BETWEEN %s AND %s")
+        params += [low, high]
+
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _read_sql(sql, params=()):
+    conn = get_connection()
+    try:
+        return pd.read_sql(sql, conn, params=list(params) or None)
+    finally:
+        conn.close()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _read_sql_cached(sql, params, version):
+    return _read_sql(sql, params)
+
+
+def _query(sql, params=()):
+    """
+    执行只读查询；数据版本不变时同样的 SQL + 参数直接返回缓存结果
+    """
+    version = get_data_version()
+    if version is None:
+        return _read_sql(sql, params)
+    return _read_sql_cached(sql, tuple(params), (version['photos'], version['marks'][0]))
+
+
+def photo_columns():
+    """
+    drone_photos 的全部列名 (按建表顺序)
+    """
+    return list(_query("SELECT * FROM drone_photos WHERE 1 = 0").columns)
+
+
+_FACET_KEYS = [('folders', 'folder'), ('types', 'type'), ('models', 'model'), ('versions', 'version'),
+               ('dir1', 'dir1'), ('dir2', 'dir2'), ('dir3', 'dir3')]
+
+
+def query_facets():
+    """
+    侧边栏下拉选项：文件夹 / 类型 / 机型 / 版本 / 目录层级的取值列表，以及拍摄时间范围
+    优先读 photo_facets 汇总表 (几百行)，旧库没有该表时退回全表 DISTINCT
+    """
+    try:
+        df = _query("SELECT facet, value, cnt, min_time, max_time FROM photo_facets ORDER BY facet, value")
+    except Exception:
+        return _scan_facets()
+
+    facets = {key: df.loc[df['facet'] == facet, 'value'].tolist() for key, facet in _FACET_KEYS}
+    total = df[df['facet'] == 'all']
+    facets['min_time'] = pd.to_datetime(total['min_time'].iloc[0]) if not total.empty else pd.NaT
+    facets['max_time'] = pd.to_datetime(total['max_time'].iloc[0]) if not total.empty else pd.NaT
+    return facets
+
+
+def _scan_facets():
+    facets = {}
+    for key, column in (('folders', 'FolderName'), ('types', 'FileType'),
+                        ('models', 'DroneModel'), ('versions', 'Version')):
+        df = _query(f"SELECT DISTINCT {_col(column)} AS v FROM drone_photos "
+                    f"WHERE {_col(column)} IS NOT NULL ORDER BY v")
+        facets[key] = df['v'].tolist()
+    for key, column in (('dir1', 'dir_level_1'), ('dir2', 'dir_level_2'), ('dir3', 'dir_level_3')):
+        df = _query(f"SELECT DISTINCT {_col(column)} AS v FROM file_dir_tags "
+                    f"WHERE {_col(column)} IS NOT NULL AND {_col(column)} <> '' ORDER BY v")
+        facets[key] = df['v'].tolist()
+    df = _query("SELECT MIN(capture_time) AS t_min, MAX(capture_time) AS t_max FROM drone_photos")
+    facets['min_time'] = pd.to_datetime(df['t_min'].iloc[0])
+    facets['max_time'] = pd.to_datetime(df['t_max'].iloc[0])
+    return facets
+
+
+def query_kpis(filters):
+    """
+    筛选结果的条数与总大小，由数据库聚合，不取明细
+    """
+    where, params = build_where(filters)
+    df = _query(f"SELECT COUNT(*) AS cnt, SUM(FileSize) AS total_size FROM drone_photos{where}", params)
+    return {'count': int(df['cnt'].iloc[0] or 0), 'total_size': float(df['total_size'].iloc[0] or 0)}
+
+
+def query_range(filters, column):
+    """
+    某个数值列在当前筛选条件下的 (最小值, 最大值)
+    """
+    where, params = build_where(filters)
+    df = _query(f"SELECT MIN({_col(column)}) AS lo, MAX({_col(column)}) AS hi FROM drone_photos{where}", params)
+    return df['lo'].iloc[0], df['hi'].iloc[0]
+
+
+def _keyset_clause(cursor):
+    """
+    键集分页：接着上一页最后一条 (capture_time, id) 往后取，排序为 capture_time DESC, id DESC，
+    capture_time 为空的记录排在最后
+    """
+    last_time, last_id = cursor
+    if last_time is None:
+        return "(capture_time IS NULL AND id < %s)", [last_id]
+    return ("(capture_time < %s OR (capture_time = %s AND id < %s) OR capture_time IS NULL)",
+            [last_time, last_time, last_id])
+
+
+def query_page(filters, columns=None, page_size=200, cursor=None):
+    """
+    取一页明细，返回 (DataFrame, 下一页游标)；没有下一页时游标为 None
+    columns 为 None 时取全部列；capture_time、id 会自动补上用于分页
+    """
+    where, params = build_where(filters)
+    if cursor is not None:
+        keyset_sql, keyset_params = _keyset_clause(cursor)
+        where = (where + " AND " if where else " WHERE ") + keyset_sql
+        params = params + keyset_params
+
+    if columns:
+        select_cols = list(dict.fromkeys(list(columns) + ['capture_time', 'id']))
+        select_sql = ", ".join(_col(c) for c in select_cols)
+    else:
+        select_sql = "*"
+
+    sql = (f"SELECT {select_sql} FROM drone_photos{where} "
+           f"ORDER BY capture_time DESC, id DESC LIMIT {int(page_size) + 1}")
+    df = _query(sql, params)
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        last_time = None if pd.isna(last['capture_time']) else pd.Timestamp(last['capture_time']).to_pydatetime()
+        next_cursor = (last_time, int(last['id']))
+    return df, next_cursor
+
+
+def _sort_by_time(df):
+    if 'capture_time' in df.columns:
+        df = df.sort_values('capture_time', ascending=False, na_position='last', ignore_index=True)
+    return df
+
+
+def query_rows_by_ids(ids, columns=None, chunk_size=1000):
+    """
+    按 id 取明细 (地图框选结果等)，分批 IN 查询，结果按 capture_time 倒序
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return pd.DataFrame(columns=list(columns or []))
+    select_sql = ", ".join(_col(c) for c in columns) if columns else "*"
+    frames = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        frames.append(_read_sql(
+            f"SELECT {select_sql} FROM drone_photos WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk
+        ))
+    return _sort_by_time(pd.concat(frames, ignore_index=True))
+
+
+def query_photos(filters, columns=None):
+    """
+    取全部符合条件的记录 (导出、同步到地图时使用)；结果可能很大，不放进缓存
+    """
+    where, params = build_where(filters)
+    select_sql = ", ".join(_col(c) for c in columns) if columns else "*"
+    return _read_sql(f"SELECT {select_sql} FROM drone_photos{where} ORDER BY capture_time DESC, id DESC", params)
+
+
+# 有效坐标：与地图打点一致，排除空值和 (0, 0)
+_GPS_VALID = "GpsLatitude IS NOT NULL AND GpsLongitude IS NOT NULL AND GpsLatitude <> 0 AND GpsLongitude <> 0"
+
+
+def _shape_select(select_sql, ring):
+    # MySQL: geo_point 上有空间索引，矩形用 MBRContains，多边形用 ST_Contains
+    func = "MBRContains" if is_rectangle(ring) else "ST_Contains"
+    sql = (f"SELECT {select_sql} FROM drone_photos WHERE "
+           f"{func}(ST_GeomFromText(%s), geo_point) AND {_GPS_VALID}")
+    return sql, [ring_wkt(ring)]
+
+
+def _bbox_select(select_sql, ring):
+    lon_min, lat_min, lon_max, lat_max = ring_bounds(ring)
+    sql = (f"SELECT {select_sql} FROM drone_photos WHERE "
+           f"GpsLatitude BETWEEN %s AND %s AND GpsLongitude BETWEEN %s AND %s AND {_GPS_VALID}")
+    return sql, [lat_min, lat_max, lon_min, lon_max]
+
+
+def _circle_select(select_sql, circle):
+    # MySQL: 先用包围盒走空间索引，再按球面距离精确判断
+    lon, lat, radius = circle
+    sql = (f"SELECT {select_sql} FROM drone_photos WHERE "
+           f"MBRContains(ST_GeomFromText(%s), geo_point) "
+           f"AND ST_Distance_Sphere(geo_point, ST_GeomFromText(%s)) <= %s AND {_GPS_VALID}")
+    return sql, [ring_wkt(circle_ring(lon, lat, radius)), f"POINT({lon!r} {lat!r})", radius]
+
+
+def parse_shapes(drawings, marker_radius=None):
+    """
+    地图绘制结果 (GeoJSON Feature 列表) 拆成多边形外环和圆 [(经度, 纬度, 半径米)]
+    矩形 / 多边形取外环；圆形取绘制的半径；标记点按 marker_radius 当作圆
+    """
+    rings = [r for r in (shape_ring((d or {}).get('geometry')) for d in drawings) if r]
+    circles = [c for c in (shape_circle(d, marker_radius) for d in drawings) if c]
+    return rings, circles
+
+
+def query_in_shapes(drawings, columns=None, marker_radius=None):
+    """
+    地图框选：取落在任一选区 (矩形 / 多边形 / 圆 / 标记点加半径) 内的全部记录，结果按 capture_time 倒序
+    MySQL 走 geo_point 空间索引；SQLite 或旧库没有 geo_point 时，按经纬度包围盒查询后在本地精确判断
+    """
+    rings, circles = parse_shapes(drawings, marker_radius)
+    if not rings and not circles:
+        return pd.DataFrame(columns=list(columns or []))
+    # 带上 id 才能按记录去重；经纬度用于本地精确判断
+    select_cols = list(dict.fromkeys(list(columns) + ['id', 'GpsLatitude', 'GpsLongitude'])) if columns else None
+    select_sql = ", ".join(_col(c) for c in select_cols) if select_cols else "*"
+
+    if not is_sqlite():
+        parts = [_shape_select(select_sql, ring) for ring in rings]
+        parts += [_circle_select(select_sql, circle) for circle in circles]
+        try:
+            # 每个选区单独一段，各自用上空间索引，UNION 去掉重叠部分的重复记录
+            df = _read_sql(" UNION ".join(sql for sql, _ in parts), [v for _, p in parts for v in p])
+            return _sort_by_time(df[list(columns)] if columns else df)
+        except Exception as e:
+            print(f"空间查询失败，改为按经纬度范围查询: {e}")
+
+    frames = []
+    for ring in rings:
+        df = _read_sql(*_bbox_select(select_sql, ring))
+        if not is_rectangle(ring):
+            df = df[points_in_polygon(df['GpsLongitude'], df['GpsLatitude'], ring)]
+        frames.append(df)
+    for lon, lat, radius in circles:
+        df = _read_sql(*_bbox_select(select_sql, circle_ring(lon, lat, radius)))
+        frames.append(df[distance_m(lon, lat, df['GpsLongitude'], df['GpsLatitude']) <= radius])
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='id', ignore_index=True)
+    return _sort_by_time(df[list(columns)] if columns else df)
+
+def query_in_bounds(bounds, columns=None, budget=None):
+    """
+    地图视野 (南, 西, 北, 东) 内的记录，返回 (DataFrame, 视野内总条数)
+    超过 budget 条时在数据库中按网格抽样：视野划成约 4 * budget 个格子，每格只取 id 最小的一条，
+    读回的行数与 budget 同一量级，再由调用方均匀抽稀；每次平移的视野都不同，不走查询缓存
+    """
+    south, west, north, east = bounds
+    ring = [(west, south), (east, south), (east, north), (west, north), (west, south)]
+    select_sql = ", ".join(_col(c) for c in columns) if columns else "*"
+
+    select = _bbox_select
+    total = None
+    if not is_sqlite():
+        try:
+            total = int(_read_sql(*_shape_select("COUNT(*) AS n", ring))['n'].iloc[0])
+            select = _shape_select
+        except Exception as e:
+            print(f"空间查询失败，改为按经纬度范围查询: {e}")
+    if total is None:
+        total = int(_read_sql(*_bbox_select("COUNT(*) AS n", ring))['n'].iloc[0])
+    if not budget or total <= budget:
+        return _read_sql(*select(select_sql, ring)), total
+
+    # 格子编号相对视野的西南角计算，都是非负数，SQLite 可以用 CAST 取整
+    cell = "CAST((%s - %%s) / %%s AS INTEGER)" if is_sqlite() else "FLOOR((%s - %%s) / %%s)"
+    sample_sql, sample_params = select("MIN(id)", ring)
+    sample_sql += f" GROUP BY {cell % 'GpsLatitude'}, {cell % 'GpsLongitude'}"
+
+    def grid_params(side):
+        return sample_params + [south, (north - south) / side or 1e-9, west, (east - west) / side or 1e-9]
+
+    # 点集中在视野一角时大部分格子是空的，逐级加密网格，直到抽出的点够 budget 条
+    side = 2 * max(math.isqrt(int(budget)), 1)
+    for _ in range(4):
+        sampled = _read_sql(f"SELECT COUNT(*) AS n FROM ({sample_sql}) s", grid_params(side))['n'].iloc[0]
+        if sampled >= budget:
+            break
+        side *= 4
+    sql = f"SELECT {select_sql} FROM drone_photos WHERE id IN ({sample_sql})"
+    return _read_sql(sql, grid_params(side)), total
+
+
+def density_levels(zoom):
+    """
+    当前缩放级别可用的网格层级，从细到粗 (细于当前缩放的层级不用)
+    """
+    levels = sorted(MAP_CONFIG['grid_zooms'], reverse=True)
+    return [z for z in levels if z <= zoom] or levels[-1:]
+
+
+def query_density(zoom, bounds=None):
+    """
+    密度网格：取范围内不超过 MAP_CONFIG['max_cells'] 个格子的最细一层，返回 (层级, 格子 DataFrame)
+    bounds 为 (南, 西, 北, 东)，按每层的 cx / cy 范围查询 (走 (level, cx, cy) 主键)；为 None 时取全库
+    格子列为 cx, cy, cnt, alt_sum, alt_cnt, rtk_fixed_cnt
+    """
+    def cell_range(level):
+        if bounds is None:
+            return "", ()
+        size = grid_cell_size(level)
+        south, west, north, east = bounds
+        return (" AND cx BETWEEN %s AND %s AND cy BETWEEN %s AND %s",
+                (math.floor(west / size), math.floor(east / size), math.floor(south / size), math.floor(north / size)))
+
+    levels = density_levels(zoom)
+    level = levels[-1]
+    for z in levels:
+        cond, params = cell_range(z)
+        n = _query(f"SELECT COUNT(*) AS n FROM density_grid WHERE level = %s{cond}", (z,) + params)['n'].iloc[0]
+        if n <= MAP_CONFIG['max_cells']:
+            level = z
+            break
+    cond, params = cell_range(level)
+    df = _query(f"SELECT cx, cy, cnt, alt_sum, alt_cnt, rtk_fixed_cnt FROM density_grid WHERE level = %s{cond}",
+                (level,) + params)
+    return level, df
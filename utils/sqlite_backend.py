@@ -0,0 +1,162 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, date
+
+import numpy as np
+
+# 与 sql.txt 对应的 SQLite 建表脚本 (项目根目录)
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql_sqlite.txt')
+
+# MySQL 写法 -> SQLite 写法，仅覆盖项目中用到的几处差异
+_SQL_REWRITES = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.I), 'INSERT OR IGNORE'),
+    (re.compile(r'\bUPDATE\s+IGNORE\b', re.I), 'UPDATE OR IGNORE'),
+    (re.compile(r'\bTRUNCATE\s+TABLE\b', re.I), 'DELETE FROM'),
+]
+
+# 后来新增的列：(表, 列, 类型)。已有的数据库文件在执行建表脚本前补齐，脚本中的新索引才能建成功
+UPGRADE_COLUMNS = [
+    ('drone_photos', 'folder_id', 'INT'),
+    ('file_dir_tags', 'folder_id', 'INT'),
+]
+# 后来新增的汇总表，已有的数据库文件建表后按全表生成一次
+SUMMARY_TABLES = ['folder_stats', 'folder_models', 'density_grid']
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def translate_sql(sql):
+    """
+    把项目中的 MySQL 风格 SQL 改写为 SQLite 可执行的形式 (%s 占位符、IGNORE、TRUNCATE)
+    """
+    for pattern, repl in _SQL_REWRITES:
+        sql = pattern.sub(repl, sql)
+    return sql
+
+
+def _parse_datetime(raw):
+    text = raw.decode()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return text
+
+
+# 与 mysql.connector 保持一致：DATETIME/TIMESTAMP 列读出为 datetime，写入时转为文本
+sqlite3.register_converter("DATETIME", _parse_datetime)
+sqlite3.register_converter("TIMESTAMP", _parse_datetime)
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(sep=' '))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+for _np_type in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64):
+    sqlite3.register_adapter(_np_type, int)
+sqlite3.register_adapter(np.float32, float)
+sqlite3.register_adapter(np.bool_, bool)
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """
+    执行前自动改写 SQL，调用方可以继续使用 %s 占位符
+    """
+
+    def execute(self, sql, parameters=()):
+        return super().execute(translate_sql(sql), tuple(parameters) if parameters is not None else ())
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().executemany(translate_sql(sql), seq_of_parameters)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """
+    每个线程复用一个连接 (语句缓存随连接保留)，close() 只回滚未提交的事务，
+    与连接池中 close() 即归还的用法保持一致
+    """
+
+    def cursor(self, factory=SQLiteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        super().close()
+
+
+def connect(path, timeout=10, init_schema=True):
+    """
+    打开 SQLite 数据库文件：WAL 日志模式，读写互不阻塞；首次打开时按 sql_sqlite.txt 建表
+    """
+    path = os.path.abspath(path)
+    conn = sqlite3.connect(
+        path,
+        timeout=timeout,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+        cached_statements=256,
+        factory=SQLiteConnection,
+    )
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    if init_schema:
+        ensure_schema(conn, path)
+    return conn
+
+
+def ensure_schema(conn, path):
+    """
+    执行建表脚本 (全部为 IF NOT EXISTS)，每个进程每个文件只执行一次
+    """
+    with _schema_lock:
+        if path in _schema_ready:
+            return
+        added = _add_missing_columns(conn)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+        with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+        # 延迟导入：database 模块依赖本模块
+        if added:
+            from utils.database import backfill_folders
+            backfill_folders(conn)
+        if 'drone_photos' in tables and not set(SUMMARY_TABLES) <= tables:
+            from utils.database import rebuild_summaries
+            rebuild_summaries(conn.cursor())
+        conn.commit()
+        _schema_ready.add(path)
+
+
+def _add_missing_columns(conn):
+    added = []
+    for table, column, col_type in UPGRADE_COLUMNS:
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info(`{table}`)").fetchall()]
+        if existing and column not in existing:
+            conn.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {col_type}")
+            added.append((table, column))
+    return added
+
+
+_local = threading.local()
+
+
+def get_thread_connection(path, timeout=10):
+    """
+    取当前线程的 SQLite 连接，不存在 (或数据库文件变更) 时新建
+    """
+    path = os.path.abspath(path)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != path:
+        conn = connect(path, timeout=timeout)
+        _local.conn = conn
+        _local.path = path
+    return conn